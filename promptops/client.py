@@ -0,0 +1,151 @@
+import gzip
+import json as jsonlib
+import threading
+from typing import Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from promptops import settings
+
+CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 30
+# read timeouts by path, the generating endpoints wait for a model and can take a while to answer
+READ_TIMEOUTS = {
+    "/query": 90,
+    "/curated": 15,
+    "/explain": 90,
+    "/correction": 60,
+    "/embeddings": 20,
+    "/index_data": 120,
+    "/feedback": 5,
+    "/version": 5,
+    "/skills/commit_message": 90,
+    "/skills/predict": 30,
+    "/recipe/stream": 120,
+    "/recipe/init": 120,
+    "/recipe/steps": 15,
+    "/recipe/save": 15,
+    "/config": 5,
+    "/installed": 5,
+}
+# request bodies smaller than this are sent as is, compressing them doesn't pay off
+COMPRESS_MIN_BYTES = 1024
+# an overloaded backend answers these before processing the request, so any request is sent again after them
+UNPROCESSED_STATUSES = (429, 503)
+# gateway errors can come after the backend processed the request, e.g. started a generation, so only the
+# requests of these paths, which are cheap and safe to send twice, are sent again after them
+GATEWAY_STATUSES = (502, 504)
+RETRY_GATEWAY_PATHS = ("/embeddings", "/version")
+
+# sessions by the statuses they retry
+_sessions: dict[tuple[int, ...], requests.Session] = {}
+_session_lock = threading.Lock()
+
+
+def get_session(retry_statuses: tuple[int, ...] = UNPROCESSED_STATUSES) -> requests.Session:
+    """
+    :param retry_statuses: statuses after which the request is sent again, the retries can't be set per request
+    :return: the shared session, it keeps the connections to the backend alive between requests
+    """
+    with _session_lock:
+        session = _sessions.get(retry_statuses)
+        if session is None:
+            retry = Retry(
+                total=3,
+                connect=3,
+                # a read error means the backend may have processed the request already, don't send it twice
+                read=0,
+                status=2 if retry_statuses else 0,
+                status_forcelist=retry_statuses,
+                allowed_methods=None,
+                backoff_factor=0.25,
+                raise_on_status=False,
+            )
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[retry_statuses] = session
+    return session
+
+
+def _retry_statuses(path: str, retry_status: bool) -> tuple[int, ...]:
+    if not retry_status:
+        return ()
+    if path.split("?", 1)[0] in RETRY_GATEWAY_PATHS:
+        return UNPROCESSED_STATUSES + GATEWAY_STATUSES
+    return UNPROCESSED_STATUSES
+
+
+def _timeout(path: str) -> tuple[float, float]:
+    path = path.split("?", 1)[0]
+    for prefix, read_timeout in READ_TIMEOUTS.items():
+        if path == prefix or path.startswith(prefix + "/"):
+            return CONNECT_TIMEOUT, read_timeout
+    return CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+
+
+def _headers(headers: Optional[dict]) -> dict:
+    from promptops import user
+
+    return {"user-agent": user.user_agent(), **(headers or {})}
+
+
+def post(
+    path: str,
+    *,
+    json: object = None,
+    data: Union[bytes, str, None] = None,
+    headers: Optional[dict] = None,
+    stream: bool = False,
+    timeout: Union[float, tuple[float, float], None] = None,
+    retry_status: bool = True,
+) -> requests.Response:
+    """
+    Posts to the backend. Larger bodies are gzip compressed, unless settings.compress_requests is off.
+    :param path: path relative to settings.endpoint, including the query string
+    :param json: request object, sent as json
+    :param data: raw request body, used when json is None
+    :param timeout: overrides the timeout of the path
+    :param retry_status: send the request again when the backend is overloaded, off for callers that retry and
+        back off themselves
+    """
+    headers = _headers(headers)
+    if json is not None:
+        data = jsonlib.dumps(json)
+        headers["content-type"] = "application/json"
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if data is not None and settings.compress_requests and len(data) >= COMPRESS_MIN_BYTES:
+        data = gzip.compress(data, compresslevel=5)
+        headers["content-encoding"] = "gzip"
+    if data is not None:
+        headers["content-length"] = str(len(data))
+    return get_session(_retry_statuses(path, retry_status)).post(
+        settings.endpoint + path,
+        data=data,
+        headers=headers,
+        stream=stream,
+        timeout=timeout or _timeout(path),
+    )
+
+
+def get(
+    path: str,
+    *,
+    headers: Optional[dict] = None,
+    stream: bool = False,
+    timeout: Union[float, tuple[float, float], None] = None,
+) -> requests.Response:
+    """
+    :param path: path relative to settings.endpoint, including the query string
+    """
+    # reading is safe to repeat
+    return get_session(UNPROCESSED_STATUSES + GATEWAY_STATUSES).get(
+        settings.endpoint + path,
+        headers=_headers(headers),
+        stream=stream,
+        timeout=timeout or _timeout(path),
+    )
@@ -3,11 +3,10 @@ from dataclasses import dataclass
 import logging
 from typing import Optional
 
-import requests
+from promptops import client
 from promptops import settings
 from promptops.similarity import VectorDB
 from promptops.trace import trace_id
-from promptops.user import user_id
 from promptops import scrub_secrets
 
 
@@ -39,7 +38,7 @@ _db: Optional[VectorDB] = None
 def get_db() -> VectorDB:
     global _db
     if _db is None:
-        _db = VectorDB()
+        _db = VectorDB(key=lambda obj: obj["question"])
         path = os.path.expanduser(settings.corrections_db_path)
         if os.path.exists(path):
             logging.debug("loading corrections db")
@@ -50,8 +49,8 @@ def get_db() -> VectorDB:
 
 
 def get_correction(prompt: str, command: str, error: str) -> Optional[str]:
-    resp = requests.post(
-        settings.endpoint + "/correction",
+    resp = client.post(
+        "/correction",
         json={
             "prompt": prompt,
             "command": scrub_secrets.scrub_line(".bash_history", command),
@@ -59,9 +58,6 @@ def get_correction(prompt: str, command: str, error: str) -> Optional[str]:
             "model": settings.model,
             "trace_id": trace_id,
         },
-        headers={
-            "user-agent": f"promptops-cli; user_id={user_id()}",
-        },
     )
 
     try:
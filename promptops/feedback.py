@@ -3,9 +3,7 @@ import typing
 from concurrent.futures import ThreadPoolExecutor
 
 from promptops import trace
-from promptops import settings
-from promptops import user
-import requests
+from promptops import client
 
 
 class FeedbackProcessor:
@@ -15,11 +13,9 @@ class FeedbackProcessor:
 
     @staticmethod
     def _send(payload: dict):
-        requests.post(settings.endpoint + "/feedback", json={
+        client.post("/feedback", json={
             "trace_id": trace.trace_id,
             **payload
-        }, headers={
-            "user-agent": f"promptops-cli; user_id={user.user_id()}"
         })
         # feedback is best-effort, so we don't raise for status
 
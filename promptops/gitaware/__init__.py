@@ -1 +1 @@
-from .project import git_root, is_ignored
+from .project import git_root, is_ignored, ignored_paths
@@ -20,3 +20,21 @@ def is_ignored(path):
             return False
         else:
             return True
+
+
+def ignored_paths(root, paths: list[str]) -> set[str]:
+    """
+    Checks many paths with a single git call.
+    :return: the paths that are ignored by git, nothing is ignored outside of a git repository
+    """
+    if not paths:
+        return set()
+    result = subprocess.run(
+        ["git", "-C", root, "check-ignore", "--stdin", "-z"],
+        input="\0".join(paths).encode("utf-8"),
+        capture_output=True,
+    )
+    if result.returncode not in (0, 1):
+        logging.debug("check-ignore in %s return code: %d", root, result.returncode)
+        return set()
+    return {path for path in result.stdout.decode("utf-8").split("\0") if path}
@@ -1,15 +1,29 @@
+import hashlib
+import json
 import os.path
 import logging
-from typing import Optional, List
-import requests
+from itertools import chain, islice
+from typing import Optional, Iterable, Iterator
 import numpy as np
+import requests
 
-from promptops.similarity import VectorDB
+from promptops.similarity import VectorDB, embedding_batch, fetch_embeddings
+from promptops.similarity.pipeline import embed_concurrently
 from promptops.shells import get_shell
 from promptops import settings
-from promptops.user import user_id
 
 _hist_db: Optional[VectorDB] = None
+# the checkpoint keeps a hash of this many bytes before its offset, to notice a history file rewritten in place
+FINGERPRINT_BYTES = 64
+
+
+def history_key(obj) -> str:
+    # older history dbs stored plain command strings
+    return obj if isinstance(obj, str) else obj["cmd"]
+
+
+def is_ignored(obj) -> bool:
+    return isinstance(obj, dict) and obj.get("ignore", False)
 
 
 def get_history_db() -> VectorDB:
@@ -22,7 +36,7 @@ def get_history_db() -> VectorDB:
     """
     global _hist_db
     if _hist_db is None:
-        _hist_db = VectorDB()
+        _hist_db = VectorDB(key=history_key, exclude=is_ignored)
         path = os.path.expanduser(settings.history_db_path)
         if os.path.exists(path):
             logging.debug("loading history db")
@@ -33,39 +47,84 @@ def get_history_db() -> VectorDB:
 
 def check_history(embedding):
     history_db = get_history_db()
-    results = history_db.search(embedding, k=3, min_similarity=0.8)
-    results = [(obj, score) for obj, score in results if not isinstance(obj, dict) or not obj.get("ignore", False)]
-    return results
-
-
-def embedding_batch(cmds: List[str]) -> List[tuple[str, np.ndarray]]:
-    resp = requests.post(
-        settings.endpoint + "/embeddings",
-        json={
-            "batch": cmds,
-        },
-        headers={
-            "user-agent": f"promptops-cli; user_id={user_id()}",
-        },
-    )
+    # ignored entries are excluded by the db itself
+    return history_db.search(embedding, k=3, min_similarity=0.8)
+
+
+def _load_checkpoints() -> dict:
+    path = os.path.expanduser(settings.history_checkpoints_path)
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.debug(f"no history checkpoints: {e}")
+        return {}
+
+
+def _save_checkpoint(history_file: str, checkpoint: dict):
+    path = os.path.expanduser(settings.history_checkpoints_path)
+    checkpoints = _load_checkpoints()
+    checkpoints[history_file] = checkpoint
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoints, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.debug(f"failed to save the history checkpoint: {e}")
 
+
+def _fingerprint(history_file: str, offset: int) -> Optional[str]:
+    """
+    :return: hash of the bytes of the history file right before offset, None if they can't be read
+    """
+    start = max(0, offset - FINGERPRINT_BYTES)
     try:
-        resp.raise_for_status()
-    except Exception as e:
-        logging.debug(f"error getting embeddings: {e}, {resp.text}")
-        raise
-    # best effort for now
-    result = resp.json().get("result", [])
-    items = []
-    for item in result:
-        cmd = item["text"]
-        vector = np.array(item["embeddings"])
-        items.append((cmd, vector))
+        with open(history_file, "rb") as f:
+            f.seek(start)
+            data = f.read(offset - start)
+    except OSError as e:
+        logging.debug(f"failed to read {history_file}: {e}")
+        return None
+    if len(data) < offset - start:
+        return None
+    return hashlib.sha256(data).hexdigest()
+
 
-    return items
+def _history_since_checkpoint(
+    shell, history_file: str, checkpoint: Optional[dict], stat: os.stat_result
+) -> Optional[tuple[list[str], int]]:
+    """
+    :return: the commands appended to the history file since the last indexing and the offset after them, None if
+        the file has no checkpoint or was rewritten since, e.g. by a shell that trims its history. Shells like bash
+        without histappend rewrite the file in place, keeping the inode and possibly growing it, so the bytes
+        before the offset have to match too.
+    """
+    if checkpoint is None or checkpoint.get("inode") != stat.st_ino or stat.st_size < checkpoint.get("size", 0):
+        return None
+    fingerprint = checkpoint.get("fingerprint")
+    if fingerprint is None or fingerprint != _fingerprint(history_file, checkpoint["offset"]):
+        return None
+    if stat.st_size == checkpoint["size"]:
+        return [], checkpoint["offset"]
+    return shell.get_history_since(checkpoint["offset"])
+
+
+def _fetch_history_batch(texts: list[str]) -> list[tuple[str, np.ndarray]]:
+    # the batches are sized by the pipeline, the dispatcher would split them at its own maximum. The pipeline
+    # also backs off on overloaded answers, so the client doesn't retry them on top
+    return embedding_batch(texts, fetch=lambda batch: fetch_embeddings(batch, retry_status=False))
 
 
 def index_history(show_progress: bool = None, max_history: int = 1000):
+    """
+    Indexes the commands of the shell history that are not in the history db. After the first run only the part of
+    the history file that was appended since the previous run is read, see _history_since_checkpoint().
+    Every batch of embeddings is committed right away, and a run that is interrupted is resumed by the next one.
+    :param max_history: index at most this many of the latest commands, 0 indexes the full history
+    :return: whether the history has more commands than max_history that were not indexed
+    """
     progress = None
     if show_progress:
         from promptops.loading.progress import ProgressSpinner
@@ -74,43 +133,90 @@ def index_history(show_progress: bool = None, max_history: int = 1000):
         progress.increment(1)
 
     db = get_history_db()
-    if max_history > 0:
-        prev_commands = get_shell().get_recent_history(max_history + 1)
+    shell = get_shell()
+    read_bytes = 0
+    consumed = 0
+
+    def on_read(size: int):
+        nonlocal read_bytes
+        read_bytes += size
+
+    def unindexed(commands: Iterable[str]) -> Iterator[str]:
+        nonlocal consumed
+        seen = set()
+        for cmd in commands:
+            consumed += 1
+            if cmd not in seen and db.find(cmd) is None:
+                seen.add(cmd)
+                yield cmd
+
+    history_file = os.path.expanduser(shell.history_file) if shell.history_file else None
+    try:
+        stat = os.stat(history_file) if history_file else None
+    except OSError:
+        stat = None
+    checkpoint = _load_checkpoints().get(history_file) if stat is not None else None
+    resume = checkpoint.get("resume") if checkpoint is not None else None
+    if resume is not None and max_history > 0 and (resume == 0 or resume > max_history):
+        logging.debug(f"resuming the interrupted indexing of the history, max_history={resume}")
+        max_history = resume
+    since_checkpoint = None
+    if stat is not None and max_history > 0 and resume is None:
+        since_checkpoint = _history_since_checkpoint(shell, history_file, checkpoint, stat)
+    if since_checkpoint is not None:
+        prev_commands, offset = since_checkpoint
     else:
-        prev_commands = get_shell().get_full_history()
-    has_more = len(prev_commands) > max_history > 0
+        # commands appended while the history is read are picked up from this offset by the next run
+        offset = stat.st_size if stat is not None else 0
+        if max_history > 0:
+            prev_commands = shell.get_recent_history(max_history + 1)
+        else:
+            # streamed from the history file to the embeddings, the full history can be far larger than memory
+            prev_commands = shell.iter_full_history(on_read)
+    has_more = max_history > 0 and len(prev_commands) > max_history
     if max_history > 0:
         prev_commands = prev_commands[-max_history:]
 
     if progress:
         progress.increment(3)
 
-    indexed_commands = {obj if isinstance(obj, str) else obj["cmd"] for obj in db.objects}
-    delta = list(set(prev_commands) - indexed_commands)
+    delta = unindexed(prev_commands)
     batch_size = 32
+    head = list(islice(delta, batch_size + 1))
+    delta = chain(head, delta)
 
-    if show_progress is None and len(delta) > batch_size:
+    if show_progress is None and len(head) > batch_size:
         from promptops.loading.progress import ProgressSpinner
-        progress = ProgressSpinner(100, header="indexing history... [ctrl+c] to cancel")
+        progress = ProgressSpinner(100, header="indexing history... [ctrl+c] to continue later")
         progress.increment(4)
     if progress:
         progress.increment(2)
 
-    if len(delta) == 0:
+    if len(head) == 0:
+        _checkpoint(history_file, stat, offset)
         if progress:
             progress.set(100)
         if not show_progress and progress:
             progress.clear()
         return has_more
 
+    if len(head) > batch_size and stat is not None:
+        # the resume cursor, the commands that were committed before an interruption are skipped by db.find()
+        _save_checkpoint(history_file, {**(checkpoint or {}), "resume": max_history})
+
     start_progress = 6
-    for i in range(0, len(delta), batch_size):
-        for cmd, vector in embedding_batch(delta[i: i + batch_size]):
-            db.add(vector, {"cmd": cmd, "ignore": False})
+    for _, items in embed_concurrently(delta, _fetch_history_batch):
+        if items:
+            db.add_batch(np.stack([vector for _, vector in items]), [{"cmd": cmd, "ignore": False} for cmd, _ in items])
+            db.commit(os.path.expanduser(settings.history_db_path))
         if progress:
-            progress.set(start_progress + (i + batch_size) / len(delta) * (100 - start_progress))
+            if isinstance(prev_commands, list):
+                done = consumed / len(prev_commands)
+            else:
+                done = read_bytes / stat.st_size if stat is not None and stat.st_size > 0 else 0
+            progress.set(start_progress + min(done, 1) * (100 - start_progress))
 
-    db.save(os.path.expanduser(settings.history_db_path))
+    _checkpoint(history_file, stat, offset)
 
     if progress:
         progress.set(100)
@@ -121,30 +227,44 @@ def index_history(show_progress: bool = None, max_history: int = 1000):
     return has_more
 
 
+def _checkpoint(history_file: Optional[str], stat: Optional[os.stat_result], offset: int):
+    if stat is None:
+        return
+    _save_checkpoint(history_file, {
+        "inode": stat.st_ino,
+        "size": max(stat.st_size, offset),
+        "offset": offset,
+        "fingerprint": _fingerprint(history_file, offset),
+    })
+
+
 def update_history():
     if settings.index_history:
         try:
             index_history()
         except KeyboardInterrupt:
             pass
+        except requests.RequestException as e:
+            # the batches indexed so far are kept, the next run continues from there
+            logging.debug(f"failed to index the history: {e}")
 
 
 def add(cmd: str, return_code: int):
     db = get_history_db()
 
-    for obj in db.objects:
-        if isinstance(obj, dict) and obj.get("cmd", None) == cmd:
-            # we just need to update here
-            obj["return_code"] = return_code
-            db.save(os.path.expanduser(settings.history_db_path))
-            return
+    row = db.find(cmd)
+    if row is not None and isinstance(db.objects[row], dict):
+        # we just need to update here
+        db.objects[row]["return_code"] = return_code
+        db.commit(os.path.expanduser(settings.history_db_path), [row])
+        return
 
     eb = embedding_batch([cmd])
     if len(eb) < 1:
         return
     cmd, vector = eb[0]
     db.add(vector, {"cmd": cmd, "ignore": False, "return_code": return_code})
-    db.save(os.path.expanduser(settings.history_db_path))
+    db.commit(os.path.expanduser(settings.history_db_path))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+import logging
+import sqlite3
+from typing import Optional, Iterable
+
+from promptops.sqlite_file import SqliteFile
+
+_COLUMNS = ("item_type", "item_location", "index_location", "added_on", "last_indexed_on", "watch", "content_hash")
+
+
+class Catalog(object):
+    """
+    The indexed items, keyed by (item_type, item_location). Backed by sqlite in WAL mode, so concurrent processes
+    can read and write it, and adding or removing an item only writes that item. Items are the dicts of
+    ItemMetadata.to_dict().
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = SqliteFile(path, self._setup)
+
+    @staticmethod
+    def _setup(conn: sqlite3.Connection):
+        conn.row_factory = sqlite3.Row
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            " item_type TEXT NOT NULL,"
+            " item_location TEXT NOT NULL,"
+            " index_location TEXT NOT NULL UNIQUE,"
+            " added_on TEXT NOT NULL,"
+            " last_indexed_on TEXT NOT NULL,"
+            " watch INTEGER NOT NULL,"
+            " content_hash TEXT,"
+            " PRIMARY KEY (item_type, item_location))"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        return self._file.connection()
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        data = dict(row)
+        data["watch"] = bool(data["watch"])
+        return data
+
+    def items(self) -> list[dict]:
+        rows = self._connection().execute(f"SELECT {', '.join(_COLUMNS)} FROM items ORDER BY rowid").fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def find(self, item_type: str, item_location: str) -> Optional[dict]:
+        row = self._connection().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM items WHERE item_type = ? AND item_location = ?",
+            (item_type, item_location),
+        ).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def is_empty(self) -> bool:
+        return self._connection().execute("SELECT 1 FROM items LIMIT 1").fetchone() is None
+
+    def upsert_many(self, items: Iterable[dict]):
+        """Adds or replaces the items in a single transaction"""
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                f"INSERT INTO items ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})"
+                " ON CONFLICT (item_type, item_location) DO UPDATE SET"
+                " last_indexed_on = excluded.last_indexed_on,"
+                " watch = excluded.watch,"
+                " content_hash = excluded.content_hash",
+                [tuple(item.get(column) for column in _COLUMNS) for item in items],
+            )
+
+    def remove(self, index_location: str):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM items WHERE index_location = ?", (index_location,))
+        logging.debug(f"removed {index_location} from the catalog")
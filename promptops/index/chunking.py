@@ -0,0 +1,67 @@
+import hashlib
+import re
+
+# chunks are packed from whole paragraphs up to this size, so an edit only changes the chunks around it
+MAX_CHUNK_CHARS = 1500
+
+_HEADING = re.compile(r"#{1,6}\s")
+
+
+def _paragraphs(text: str) -> list[tuple[str, bool]]:
+    """
+    :return: the paragraphs of the text including their trailing blank lines, and whether they start with a heading
+    """
+    paragraphs = []
+    current = []
+    for line in text.splitlines(keepends=True):
+        if current and line.strip() != "" and current[-1].strip() == "":
+            paragraphs.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        paragraphs.append("".join(current))
+    return [(p, bool(_HEADING.match(p))) for p in paragraphs]
+
+
+def _split_long(paragraph: str, max_chars: int) -> list[str]:
+    parts = []
+    current = ""
+    for line in paragraph.splitlines(keepends=True):
+        while len(line) > max_chars:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:max_chars])
+            line = line[max_chars:]
+        if len(current) + len(line) > max_chars:
+            parts.append(current)
+            current = ""
+        current += line
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_chunks(text: str, max_chars: int = MAX_CHUNK_CHARS) -> list[str]:
+    """
+    Splits a document into chunks for embedding. Chunks hold whole paragraphs where possible and markdown
+    headings always start a new chunk. Joining the chunks gives back the text.
+    """
+    chunks = []
+    current = ""
+    for paragraph, is_heading in _paragraphs(text):
+        if current and (is_heading or len(current) + len(paragraph) > max_chars):
+            chunks.append(current)
+            current = ""
+        if len(paragraph) > max_chars:
+            parts = _split_long(paragraph, max_chars)
+            chunks.extend(parts[:-1])
+            paragraph = parts[-1]
+        current += paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_hash(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
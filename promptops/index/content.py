@@ -1,86 +1,243 @@
-import json
-import mimetypes
+import dataclasses
+import hashlib
 import datetime
 import logging
 import os
-from typing import Union, Optional
+from typing import Union, Optional, Callable
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import numpy as np
 import requests
 
 from promptops.trace import trace_id
-from promptops import user
+from promptops import client
+from promptops import gitaware
 from promptops.loading.progress import ProgressSpinner
 from promptops.secret import scrub_file
-from promptops import settings
-from promptops.similarity import VectorDB
+from promptops.similarity import VectorDB, get_cache, cache_key, embedding_batch
 
-from .index_store import ItemMetadata
+from .chunking import split_chunks, chunk_hash
+from .json_stream import JSONStreamDecoder
+from .index_store import ItemMetadata, IndexStore
 
+# concurrent embedding requests when indexing many files at once, and the chunks per request
+BULK_INDEX_WORKERS = 4
+EMBED_GROUP_SIZE = 64
+STREAM_CHUNK_SIZE = 64 * 1024
 
-def index_content(content: Union[str, bytes], content_type: str) -> VectorDB:
-    response = requests.post(
-        settings.endpoint + "/index_data?trace_id=" + trace_id,
+
+def index_content(content: Union[str, bytes], content_type: str, show_progress: bool = True) -> VectorDB:
+    cache = get_cache()
+    key = cache_key("index_data", content_type, content)
+    if cache is not None and (cached := cache.get(key)) is not None:
+        logging.debug("index data loaded from cache")
+        db = VectorDB()
+        db.add_batch(*cached)
+        return db
+
+    response = client.post(
+        "/index_data?trace_id=" + trace_id,
         headers={
-            "user-agent": f"promptops-cli; user_id={user.user_id()}",
             "content-type": content_type,
-            "content-length": str(len(content)),
         },
         data=content,
         stream=True,
     )
 
     db = VectorDB()
-    buffer = b""
-    prev_index = -1
-    chunk_size = 1024
+    decoder = JSONStreamDecoder()
     spinner: Optional[ProgressSpinner] = None
-    for chunk in response.iter_content(chunk_size=chunk_size):
-        buffer += chunk
-        while True:
-            try:
-                index = buffer.index(b"}", prev_index + 1)
-            except ValueError:
-                break
-            try:
-                decoded = json.loads(buffer[:index+1])
-                buffer = buffer[index+1:]
-                prev_index = -1
-
+    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+        for decoded in decoder.feed(chunk):
+            if show_progress:
                 if spinner is None:
                     spinner = ProgressSpinner(decoded["total"])
                 spinner.set(decoded["done"])
-                for fragment in decoded["fragments"]:
-                    fragment: dict = fragment
-                    embedding = fragment.pop("embedding")
-                    db.add(np.array(embedding), fragment)
-            except json.JSONDecodeError:
-                prev_index = index
-                continue
-    if buffer:
+            fragments: list[dict] = decoded["fragments"]
+            if fragments:
+                embeddings = np.array([fragment.pop("embedding") for fragment in fragments], dtype=np.float32)
+                # appended into the spare capacity of the db, which grows geometrically
+                db.add_batch(embeddings, fragments)
+    if decoder.remaining:
         logging.info("failed to index the entire document")
-        logging.debug("remaining buffer: " + repr(buffer))
+        logging.debug("remaining buffer: " + repr(decoder.remaining))
+    elif cache is not None and len(db) > 0:
+        cache.put(key, db.vectors, db.objects)
     if spinner is not None:
         spinner.set(spinner.total)
     return db
 
 
-def index_file(path: str) -> (ItemMetadata, VectorDB):
-    mimetypes.add_type("text/markdown", ".md")
-    mimetype, _ = mimetypes.guess_type(path)
-    logging.debug("content-type: " + mimetype)
+def _read_file(path: str) -> str:
     with open(path, "r") as f:
         lines = f.readlines()
-        lines = scrub_file(path, lines)
-        db = index_content("".join(lines).encode("utf-8"), mimetype)
-    path = os.path.abspath(path)
+    return "".join(scrub_file(path, lines))
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _file_item(path: str, text: str) -> ItemMetadata:
     return ItemMetadata(
         item_type="file",
-        item_location=path,
+        item_location=os.path.abspath(path),
         index_location="",  # this is set by the store
         added_on=datetime.datetime.now(),
         last_indexed_on=datetime.datetime.now(),
         watch=True,
-    ), db
+        content_hash=content_hash(text),
+    )
+
+
+def index_file(path: str, store: Optional[IndexStore] = None) -> (ItemMetadata, VectorDB):
+    """
+    Chunks the file locally, only the chunks that are not in the store yet are sent for embedding.
+    :param store: the index to take the embeddings of already indexed chunks from
+    """
+    text = _read_file(path)
+    db, embedded = index_chunks(text, store)
+    logging.debug(f"embedded {embedded} of {len(db)} chunks of {path}")
+    return _file_item(path, text), db
+
+
+def index_files(
+    paths: list[str],
+    store: Optional[IndexStore] = None,
+    max_workers: int = BULK_INDEX_WORKERS,
+) -> list[tuple[ItemMetadata, VectorDB]]:
+    """
+    Indexes several files with a single progress bar. The files are chunked locally and a chunk that repeats
+    across the files, or is in the store already, is embedded only once. The embedding requests are sent with a
+    bounded concurrency. The files are read and scrubbed on the calling thread, because the secrets scanner is not
+    thread safe.
+    :param store: the index to take the embeddings of already indexed chunks from
+    :return: the indexed files, the ones that failed are reported and left out
+    """
+    documents = []
+    failed = []
+    for path in paths:
+        try:
+            text = _read_file(path)
+        except (OSError, UnicodeDecodeError) as e:
+            logging.debug(f"error while reading {path}", exc_info=e)
+            failed.append(path)
+            continue
+        documents.append((path, text, _chunk_fragments(text)))
+
+    hashes = {fragment["hash"] for _, _, fragments in documents for fragment in fragments}
+    known = store.chunk_embeddings(hashes) if store is not None else {}
+    missing = list(dict.fromkeys(
+        fragment["text"] for _, _, fragments in documents for fragment in fragments if fragment["hash"] not in known
+    ))
+    groups = [missing[i:i + EMBED_GROUP_SIZE] for i in range(0, len(missing), EMBED_GROUP_SIZE)]
+    logging.debug(f"embedding {len(missing)} of {len(hashes)} distinct chunks")
+
+    embedded = {}
+    spinner = ProgressSpinner(max(len(groups), 1), text="Indexing")
+    spinner.set(0)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(embedding_batch, group) for group in groups}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    embedded.update(future.result())
+                except Exception as e:
+                    # the chunks of the group are left out, which fails their files below
+                    logging.debug("error while embedding chunks", exc_info=e)
+                spinner.increment(1)
+    spinner.set(spinner.total)
+
+    results = []
+    for path, text, fragments in documents:
+        db, complete = _fragments_db(fragments, known, embedded)
+        if not complete:
+            failed.append(path)
+            continue
+        results.append((_file_item(path, text), db))
+    for path in failed:
+        print("failed to index:", path)
+    return results
+
+
+def discover_files(root: str, accept_file: Callable[[str, str], bool]) -> list[str]:
+    """
+    :param accept_file: called with the directory and the name of every file
+    :return: the accepted files under root that are not ignored by git
+    """
+    files = []
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        for filename in filenames:
+            if accept_file(dirpath, filename):
+                files.append(os.path.join(dirpath, filename))
+        dirnames[:] = filter(lambda d: d != ".git", dirnames)
+    ignored = gitaware.ignored_paths(root, files)
+    return [file for file in files if file not in ignored]
+
+
+def _chunk_fragments(text: str) -> list[dict]:
+    return [{"text": chunk, "hash": chunk_hash(chunk)} for chunk in split_chunks(text)]
+
+
+def _fragments_db(fragments: list[dict], known: dict[str, np.ndarray], embedded: dict[str, np.ndarray]) -> (VectorDB, bool):
+    """
+    :return: a db with the fragments that have an embedding, and whether all of them had one
+    """
+    vectors = []
+    objects = []
+    for fragment in fragments:
+        vector = known.get(fragment["hash"])
+        if vector is None:
+            vector = embedded.get(fragment["text"])
+        if vector is None:
+            logging.debug(f"no embedding for chunk {fragment['hash']}")
+            continue
+        vectors.append(vector)
+        objects.append(fragment)
+    db = VectorDB()
+    if objects:
+        db.add_batch(np.stack(vectors), objects)
+    return db, len(objects) == len(fragments)
+
+
+def index_chunks(text: str, store: Optional[IndexStore] = None) -> (VectorDB, int):
+    """
+    Chunks the text locally and embeds the chunks. Chunks are addressed by their hash: the ones that are indexed
+    already, for any item of the store, reuse the stored embedding and the others go through the embeddings
+    cache, so only the chunks that were never seen are sent to the backend.
+    :param store: the index to take the embeddings of already indexed chunks from
+    :return: a db with a fragment per chunk, and the number of chunks that had to be embedded
+    """
+    fragments = _chunk_fragments(text)
+    known = store.chunk_embeddings(f["hash"] for f in fragments) if store is not None else {}
+    embedded = dict(embedding_batch([f["text"] for f in fragments if f["hash"] not in known]))
+    db, _ = _fragments_db(fragments, known, embedded)
+    return db, len(embedded)
+
+
+def refresh_file(store: IndexStore, item: ItemMetadata) -> Optional[int]:
+    """
+    Re-indexes a watched file if it changed since it was last indexed. Only the chunks that are not part of the
+    indexed version are embedded again.
+    :return: the number of embedded chunks, None if the file didn't change
+    """
+    path = item.item_location
+    modified_on = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+    if item.content_hash is not None and modified_on <= item.last_indexed_on:
+        return None
+    text = _read_file(path)
+    text_hash = content_hash(text)
+    if text_hash == item.content_hash:
+        # touched, but not changed
+        item.last_indexed_on = datetime.datetime.now()
+        store.update(item)
+        return None
+    db, embedded = index_chunks(text, store)
+    store.add_or_update(
+        dataclasses.replace(item, last_indexed_on=datetime.datetime.now(), content_hash=text_hash),
+        db,
+    )
+    return embedded
 
 
 def index_url(location: str) -> (ItemMetadata, VectorDB):
@@ -1,12 +1,14 @@
 import os.path
 import shutil
 
+import requests
+
 from promptops.similarity import embedding
 from promptops import settings
 from promptops.feedback import feedback
 
 from .index_store import IndexStore
-from .content import index_url, index_file
+from .content import index_url, index_file, index_files, discover_files, refresh_file
 
 
 def is_url(source):
@@ -23,18 +25,29 @@ def mid_ellipsis(s: str, max_len: int) -> str:
 def entry_point(args):
     if args.action == "add":
         source_path = args.source
+        if getattr(args, "recursive", False) and os.path.isdir(source_path):
+            files = discover_files(source_path, lambda _, fname: fname.lower().endswith(".md"))
+            feedback({"event": "index_add_recursive", "count": len(files)})
+            print(f"indexing {len(files)} files in {source_path}")
+            store = IndexStore(os.path.expanduser(settings.user_index_root))
+            store.add_or_update_many(index_files(files, store))
+            return
         print("indexing:", source_path)
         feedback({"event": "index_add", "path": source_path})
+        store = IndexStore(os.path.expanduser(settings.user_index_root))
         if is_url(source_path):
             item_meta, db = index_url(source_path)
         else:
-            item_meta, db = index_file(source_path)
-        store = IndexStore(os.path.expanduser(settings.user_index_root))
+            item_meta, db = index_file(source_path, store)
         store.add_or_update(item_meta, db)
     elif args.action == "test":
         store = IndexStore(os.path.expanduser(settings.user_index_root))
-        vector = embedding(args.query)
-        items = store.search(vector, min_similarity=0.0)
+        try:
+            vector = embedding(args.query)
+        except requests.RequestException as e:
+            print(f"embeddings not available ({e}), searching by text only")
+            vector = None
+        items = store.search(vector, min_similarity=0.0, query=args.query)
         for item in items:
             print(item)
     elif args.action == "list":
@@ -56,10 +69,21 @@ def entry_point(args):
             item_type = "file"
             source_path = os.path.abspath(source_path)
         store = IndexStore(os.path.expanduser(settings.user_index_root))
-        for ix, item in enumerate(store.metadata):
-            if item.item_location == source_path and item.item_type == item_type:
-                break
-        else:
+        item = store.find(item_type, source_path)
+        if item is None:
             print(f"item not found: {source_path}")
             return
-        store.remove(ix)
+        store.remove_item(item)
+    elif args.action == "refresh":
+        feedback({"event": "index_refresh"})
+        store = IndexStore(os.path.expanduser(settings.user_index_root))
+        for item in list(store.metadata):
+            if not item.watch or item.item_type != "file":
+                continue
+            try:
+                embedded = refresh_file(store, item)
+            except FileNotFoundError:
+                print(f"missing: {item.item_location}")
+                continue
+            if embedded is not None:
+                print(f"refreshed: {item.item_location} ({embedded} chunks embedded)")
@@ -4,11 +4,16 @@ from dataclasses import dataclass
 from datetime import datetime
 import os
 import json
-from concurrent.futures import ThreadPoolExecutor
+import threading
+from collections import OrderedDict, defaultdict
 
 import numpy as np
 
-from promptops.similarity import VectorDB
+from promptops import settings
+from promptops.similarity import VectorDB, remove_db
+from .catalog import Catalog
+from .lexical import LexicalIndex
+from .text_store import TextStore
 import typing
 
 
@@ -20,6 +25,8 @@ class ItemMetadata:
     added_on: datetime
     last_indexed_on: datetime
     watch: bool
+    # sha256 of the indexed content, used to skip unchanged items when refreshing
+    content_hash: typing.Optional[str] = None
 
     def to_dict(self):
         data = dict(self.__dict__)
@@ -48,86 +55,396 @@ class SearchResult:
     score: float
 
 
+CATALOG_DB = "catalog.db"
+LEXICAL_DB = "lexical.db"
+# all fragments of all items live in this one db, so a search is a single matrix product
+FRAGMENTS_DB = "fragments.db"
+# the fragment texts are rewritten once the garbage in their files is larger than this and the live texts
+TEXT_COMPACT_MIN_BYTES = 1024 * 1024
+# approximate memory of a decoded fragment object (item, text_at, lexical_id and hash)
+FRAGMENT_OBJECT_BYTES = 800
+# hybrid searches fuse this many candidates per k from each ranking, with reciprocal rank fusion
+HYBRID_DEPTH = 4
+RRF_K = 60
+# the lexical ranking only keeps texts that contain more than this fraction of the query terms
+LEXICAL_MIN_MATCH = 0.5
+
+
+def _file_stamp(path: str) -> typing.Optional[tuple]:
+    """
+    :return: identifies the state of a db on disk, a commit appends to the journal and a save replaces the header
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    try:
+        journal_size = os.path.getsize(path + ".journal")
+    except OSError:
+        journal_size = 0
+    return stat.st_mtime_ns, stat.st_size, journal_size
+
+
+@dataclass
+class LoadedFragments:
+    db: VectorDB
+    # index_location of every item that has fragments, and the position in that list for every row
+    item_locations: typing.Optional[np.ndarray] = None
+    row_items: typing.Optional[np.ndarray] = None
+    # rows by their id in the lexical index, and whether every live row has one
+    rows_by_lexical_id: typing.Optional[dict] = None
+    lexical_complete: bool = False
+    # row of a live fragment by the hash of its chunk, for the fragments that were chunked locally
+    rows_by_hash: typing.Optional[dict] = None
+
+    def memory_size(self) -> int:
+        # rough, the objects only hold references to the texts, which live in the text files
+        return self.db.nbytes + FRAGMENT_OBJECT_BYTES * len(self.db)
+
+
+class LoadedFragmentsCache(object):
+    """
+    LRU cache of loaded fragment dbs, so repeated searches in one process (e.g. every revision of a question)
+    don't read and decode the same files again. Entries are keyed by path and only served while the files on
+    disk are unchanged. Across invocations the memory-mapped vectors stay in the OS page cache.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[tuple, LoadedFragments, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> typing.Optional[LoadedFragments]:
+        stamp = _file_stamp(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or stamp is None or entry[0] != stamp:
+                self._entries.pop(path, None)
+                return None
+            self._entries.move_to_end(path)
+            return entry[1]
+
+    def put(self, path: str, fragments: LoadedFragments):
+        """Stores fragments that are in sync with the files at path"""
+        stamp = _file_stamp(path)
+        if stamp is None:
+            return
+        size = fragments.memory_size()
+        with self._lock:
+            self._entries.pop(path, None)
+            if size > self.max_bytes:
+                return
+            self._entries[path] = (stamp, fragments, size)
+            total = sum(entry[2] for entry in self._entries.values())
+            while total > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                total -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_loaded_cache = LoadedFragmentsCache(settings.index_cache_size)
+
+
 class IndexStore:
     def __init__(self, root: str):
         self._root = root
-        self.metadata: list[ItemMetadata] = []
-        self._meta_path = os.path.join(root, "meta.json")
+        self._catalog = Catalog(os.path.join(root, CATALOG_DB))
+        self._metadata: typing.Optional[list[ItemMetadata]] = None
         self._embeddings_dir = os.path.join(root, "embeddings")
-        self.load_meta()
+        self._fragments_path = os.path.join(self._embeddings_dir, FRAGMENTS_DB)
+        self._fragments: typing.Optional[LoadedFragments] = None
+        self._texts = TextStore(self._embeddings_dir, FRAGMENTS_DB)
+        self._lexical = LexicalIndex(os.path.join(root, LEXICAL_DB))
+        self._migrate_meta_json()
 
-    def load_meta(self):
-        path = self._meta_path
+    def _migrate_meta_json(self):
+        """Moves the items of the meta.json of older versions into the catalog"""
+        path = os.path.join(self._root, "meta.json")
         if not os.path.exists(path):
             return
         with open(path, "r") as f:
             data = json.load(f)
-        self.metadata = [ItemMetadata.from_dict(item) for item in (data.get("metadata", []) or [])]
+        if self._catalog.is_empty():
+            items = [ItemMetadata.from_dict(item) for item in (data.get("metadata", []) or [])]
+            logging.debug(f"migrating {len(items)} items from {path} to the catalog")
+            self._catalog.upsert_many(item.to_dict() for item in items)
+        os.replace(path, path + ".migrated")
 
-    def save_meta(self):
-        path = self._meta_path
-        dir_name = os.path.dirname(path)
-        if not os.path.exists(dir_name):
-            os.makedirs(dir_name)
-        # make sure we don't corrupt the file
-        tmp_path = path + ".tmp"
-        with open(tmp_path, "w") as f:
-            json.dump({
-                "metadata": [item.to_dict() for item in self.metadata]
-            }, f, indent=4)
-        os.rename(tmp_path, path)
+    @property
+    def metadata(self) -> list[ItemMetadata]:
+        """All the indexed items, in the order they were added"""
+        if self._metadata is None:
+            self._metadata = [ItemMetadata.from_dict(item) for item in self._catalog.items()]
+        return self._metadata
+
+    def find(self, item_type: str, item_location: str) -> typing.Optional[ItemMetadata]:
+        item = self._catalog.find(item_type, item_location)
+        return ItemMetadata.from_dict(item) if item is not None else None
+
+    def update(self, item: ItemMetadata):
+        """Stores changes of the metadata of an item that doesn't need to be re-indexed"""
+        self._catalog.upsert_many([item.to_dict()])
+        self._metadata = None
+
+    def fragments(self) -> VectorDB:
+        """
+        :return: the db with the fragments of all items. Every object has the index_location of its item in
+            "item" and a reference to its text in "text_at", see fragment_texts().
+        """
+        return self._loaded_fragments().db
+
+    def fragment_texts(self, rows: typing.Iterable[int]) -> list[str]:
+        """
+        :return: the texts of the given rows of the fragments db, only these are read from disk
+        """
+        objects = [self.fragments().objects[row] for row in rows]
+        refs = [obj["text_at"] for obj in objects if "text_at" in obj]
+        stored = iter(self._texts.read(refs))
+        # fragments of older versions keep their text in the object until the texts are compacted
+        return [next(stored) if "text_at" in obj else obj.get("text", "") for obj in objects]
+
+    def chunk_embeddings(self, hashes: typing.Iterable[str]) -> dict[str, np.ndarray]:
+        """
+        :return: the embeddings of the indexed chunks with the given hashes, of any item
+        """
+        fragments = self._loaded_fragments()
+        db = fragments.db
+        if fragments.rows_by_hash is None:
+            fragments.rows_by_hash = {
+                obj["hash"]: i for i, obj in enumerate(db.objects) if "hash" in obj and not db.is_removed(i)
+            }
+        rows = fragments.rows_by_hash
+        hashes = [h for h in hashes if h in rows]
+        return dict(zip(hashes, db.vectors_at([rows[h] for h in hashes])))
+
+    def _fragment_objects(self, index_location: str, objects: list[dict]) -> list[dict]:
+        """Moves the texts of new fragments to the text files, and adds them to the lexical index"""
+        texts = [obj.get("text", "") for obj in objects]
+        refs = self._texts.append(texts)
+        lexical_ids = self._lexical.add(texts)
+        return [
+            {
+                **{key: value for key, value in obj.items() if key != "text"},
+                "item": index_location,
+                "text_at": ref,
+                "lexical_id": lexical_id,
+            }
+            for obj, ref, lexical_id in zip(objects, refs, lexical_ids)
+        ]
+
+    def _remove_rows(self, rows: list[int]):
+        fragments = self.fragments()
+        self._lexical.remove([
+            fragments.objects[row]["lexical_id"] for row in rows if fragments.objects[row].get("lexical_id") is not None
+        ])
+        for row in rows:
+            fragments.remove(row)
+
+    def _rows_by_lexical_id(self) -> dict:
+        fragments = self._loaded_fragments()
+        if not fragments.lexical_complete:
+            self._backfill_lexical()
+        if fragments.rows_by_lexical_id is None:
+            fragments.rows_by_lexical_id = {
+                obj["lexical_id"]: i for i, obj in enumerate(fragments.db.objects)
+                if obj.get("lexical_id") is not None and not fragments.db.is_removed(i)
+            }
+        return fragments.rows_by_lexical_id
+
+    def _backfill_lexical(self):
+        """Adds the fragments indexed by older versions to the lexical index"""
+        fragments = self._loaded_fragments()
+        db = fragments.db
+        rows = [i for i, obj in enumerate(db.objects) if "lexical_id" not in obj and not db.is_removed(i)]
+        if rows:
+            logging.debug(f"adding {len(rows)} fragments to the lexical index")
+            for row, lexical_id in zip(rows, self._lexical.add(self.fragment_texts(rows))):
+                db.objects[row]["lexical_id"] = lexical_id
+            fragments.rows_by_lexical_id = None
+            db.commit(self._fragments_path, rows)
+            _loaded_cache.put(self._fragments_path, fragments)
+        fragments.lexical_complete = True
+
+    def _loaded_fragments(self) -> LoadedFragments:
+        if self._fragments is None:
+            _loaded_cache.max_bytes = settings.index_cache_size
+            self._fragments = _loaded_cache.get(self._fragments_path)
+            if self._fragments is None:
+                db = VectorDB()
+                if os.path.exists(self._fragments_path):
+                    db.load(self._fragments_path)
+                elif self.metadata:
+                    self._migrate_shards(db)
+                self._fragments = LoadedFragments(db)
+                _loaded_cache.put(self._fragments_path, self._fragments)
+        return self._fragments
+
+    def _commit_fragments(self):
+        fragments = self._loaded_fragments()
+        fragments.row_items = None
+        fragments.rows_by_lexical_id = None
+        fragments.rows_by_hash = None
+        fragments.db.commit(self._fragments_path)
+        self._compact_texts()
+        _loaded_cache.put(self._fragments_path, fragments)
+
+    def _compact_texts(self):
+        db = self.fragments()
+        live = [i for i in range(len(db.objects)) if not db.is_removed(i)]
+        live_bytes = sum(db.objects[i]["text_at"][2] for i in live if "text_at" in db.objects[i])
+        if self._texts.size() - live_bytes <= max(TEXT_COMPACT_MIN_BYTES, live_bytes):
+            return
+        logging.debug(f"compacting fragment texts: {live_bytes} live bytes")
+        refs = self._texts.compact(self.fragment_texts(live))
+        for i, ref in zip(live, refs):
+            db.objects[i].pop("text", None)
+            db.objects[i]["text_at"] = ref
+        db.save(self._fragments_path)
+        self._texts.remove_unused({ref[0] for ref in refs})
+
+    def _migrate_shards(self, db: VectorDB):
+        """Moves the fragments from the per item files of older versions into the consolidated db"""
+        shards = []
+        for item in self.metadata:
+            shard_path = os.path.join(self._embeddings_dir, item.index_location)
+            try:
+                shard = VectorDB()
+                shard.load(shard_path)
+            except Exception as e:
+                logging.debug(f"error while loading {shard_path}", exc_info=e)
+                continue
+            if len(shard) > 0:
+                db.add_batch(shard.vectors, self._fragment_objects(item.index_location, shard.objects))
+            shards.append(shard_path)
+        logging.debug(f"migrating {len(shards)} index files to {self._fragments_path}")
+        db.save(self._fragments_path)
+        for shard_path in shards:
+            remove_db(shard_path)
+
+    def _item_rows(self, index_location: str) -> list[int]:
+        db = self.fragments()
+        return [i for i, obj in enumerate(db.objects) if obj["item"] == index_location and not db.is_removed(i)]
+
+    def item_db(self, item: ItemMetadata) -> VectorDB:
+        """
+        :return: a copy of the fragments of the item, with their texts
+        """
+        fragments = self.fragments()
+        rows = self._item_rows(item.index_location)
+        objects = [
+            {**{key: value for key, value in fragments.objects[row].items() if key not in ("item", "text_at", "lexical_id")},
+             "text": text}
+            for row, text in zip(rows, self.fragment_texts(rows))
+        ]
+        db = VectorDB()
+        if rows:
+            db.add_batch(fragments.vectors_at(rows), objects)
+        return db
+
+    def _row_item_index(self) -> tuple[np.ndarray, np.ndarray]:
+        fragments = self._loaded_fragments()
+        if fragments.row_items is None:
+            locations = np.array([obj["item"] for obj in fragments.db.objects], dtype=str)
+            fragments.item_locations, fragments.row_items = np.unique(locations, return_inverse=True)
+        return fragments.item_locations, fragments.row_items
 
     def add_or_update(self, item: ItemMetadata, db: VectorDB):
+        self.add_or_update_many([(item, db)])
+
+    def add_or_update_many(self, items: list[tuple[ItemMetadata, VectorDB]]):
+        """Adds or replaces several items, the fragments and the catalog are written once for all of them"""
         dir_name = self._embeddings_dir
         if not os.path.exists(dir_name):
             os.makedirs(dir_name)
 
-        for existing in self.metadata:
-            if item.item_location == existing.item_location and item.item_type == existing.item_type:
+        fragments = self.fragments()
+        added: dict[tuple[str, str], ItemMetadata] = {}
+        for item, db in items:
+            key = (item.item_type, item.item_location)
+            existing = added.get(key) or self.find(*key)
+            if existing is not None:
                 item.index_location = existing.index_location
-                existing.last_indexed_on = item.last_indexed_on
-                break
-        else:
-            while True:
-                index = "".join(random.choices("0123456789abcdefghijklmnopqrstuvwxyz", k=16)) + ".npz"
-                if not os.path.exists(os.path.join(dir_name, index)):
-                    break
-            item.index_location = index
-            self.metadata.append(item)
-        db.save(os.path.join(dir_name, item.index_location))
-        self.save_meta()
+                item.added_on = existing.added_on
+                self._remove_rows(self._item_rows(existing.index_location))
+            else:
+                item.index_location = "".join(random.choices("0123456789abcdefghijklmnopqrstuvwxyz", k=16))
+            added[key] = item
+            if len(db) > 0:
+                fragments.add_batch(db.vectors, self._fragment_objects(item.index_location, db.objects))
+        self._commit_fragments()
+        self._catalog.upsert_many(item.to_dict() for item in added.values())
+        self._metadata = None
 
     def remove(self, index: int):
-        item = self.metadata[index]
-        os.remove(os.path.join(self._embeddings_dir, item.index_location))
-        del self.metadata[index]
-        self.save_meta()
-
-    def search(self, vector: np.array, k=3, min_similarity=0.8, accept_source: typing.Callable[[ItemMetadata], bool] = None, context: int=1) -> list[SearchResult]:
-        futures = []
-        items = []
-
-        def search_item(item_meta: ItemMetadata):
-            db = VectorDB()
-            db.load(os.path.join(self._embeddings_dir, item_meta.index_location))
-            results = db.argsearch(vector, k=k, min_similarity=min_similarity)
-            return [SearchResult(item_meta, ItemFragment("".join(item["text"] for item in db.objects[ix-context: ix+context+1])), score)
-                    for ix, score in results]
-
-        with ThreadPoolExecutor(max_workers=16) as executor:
-            for item in self.metadata:
-                if accept_source and not accept_source(item):
-                    continue
-
-                futures.append(executor.submit(search_item, item))
-                items.append(item)
-
-        results = []
-        for item, future in zip(items, futures):
-            try:
-                results.extend(future.result())
-            except Exception as e:
-                logging.debug(f"error while searching {item}", exc_info=e)
+        self.remove_item(self.metadata[index])
+
+    def remove_item(self, item: ItemMetadata):
+        self._remove_rows(self._item_rows(item.index_location))
+        self._commit_fragments()
+        self._catalog.remove(item.index_location)
+        self._metadata = None
+
+    def search(
+        self,
+        vector: typing.Optional[np.ndarray],
+        k=3,
+        min_similarity=0.8,
+        accept_source: typing.Callable[[ItemMetadata], bool] = None,
+        context: int = 1,
+        query: str = None,
+    ) -> list[SearchResult]:
+        """
+        :param vector: embedding of the query, None to search by the query text only (e.g. offline)
+        :param query: text of the query. When given, the embedding results are fused with the lexical (bm25) ones
+            and the scores are reciprocal rank fusion scores instead of cosine similarities.
+        """
+        db = self.fragments()
+        if len(db) == 0:
+            return []
+        items = {item.index_location: item for item in self.metadata}
+        locations, row_items = self._row_item_index()
+        # rows of items that were removed from the catalog (e.g. by a crash in between the writes) are skipped too
+        accepted = np.array([
+            location in items and (accept_source is None or accept_source(items[location])) for location in locations
+        ], dtype=bool)
+        rows = None if accepted.all() else np.flatnonzero(accepted[row_items])
+
+        if query is None:
+            ranked = db.argsearch(vector, k=k, min_similarity=min_similarity, rows=rows)
+        else:
+            rankings = []
+            if vector is not None:
+                rankings.append([
+                    row for row, _ in db.argsearch(vector, k=k * HYBRID_DEPTH, min_similarity=min_similarity, rows=rows)
+                ])
+            rows_by_lexical_id = self._rows_by_lexical_id()
+            lexical = []
+            matches = self._lexical.search(query, limit=4 * k * HYBRID_DEPTH, min_match=LEXICAL_MIN_MATCH)
+            for lexical_id, _ in matches:
+                row = rows_by_lexical_id.get(lexical_id)
+                if row is not None and accepted[row_items[row]]:
+                    lexical.append(row)
+            rankings.append(lexical[:k * HYBRID_DEPTH])
+            fused = defaultdict(float)
+            for ranking in rankings:
+                for rank, row in enumerate(ranking):
+                    fused[row] += 1 / (RRF_K + rank + 1)
+            ranked = sorted(fused.items(), key=lambda x: x[1], reverse=True)[:k]
 
-        results.sort(key=lambda x: x.score, reverse=True)
-        return results[:k]
+        hits = []
+        for ix, score in ranked:
+            location = db.objects[ix]["item"]
+            neighbours = [
+                i for i in range(max(0, ix - context), min(len(db.objects), ix + context + 1))
+                if db.objects[i]["item"] == location and not db.is_removed(i)
+            ]
+            hits.append((location, neighbours, score))
+        # only the texts of the hits and their context are read
+        texts = iter(self.fragment_texts([i for _, neighbours, _ in hits for i in neighbours]))
+        return [
+            SearchResult(items[location], ItemFragment("".join(next(texts) for _ in neighbours)), score)
+            for location, neighbours, score in hits
+        ]
@@ -0,0 +1,75 @@
+import json
+import logging
+import re
+
+_TOKENS = re.compile(rb'[{}"\\]')
+
+
+class JSONStreamDecoder(object):
+    """
+    Splits a streamed sequence of json objects (newline delimited or simply concatenated) into records.
+    Every byte is scanned once and every record is parsed once, no matter how the stream is chunked.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # scan position, start of the current record, and the scanner state at the scan position
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+
+    def feed(self, data: bytes) -> list:
+        """
+        :return: the records completed by the data
+        """
+        self._buffer += data
+        buffer = self._buffer
+        records = []
+        while True:
+            match = _TOKENS.search(buffer, self._pos)
+            if match is None:
+                self._pos = len(buffer)
+                break
+            token = match.group()
+            self._pos = match.end()
+            if self._in_string:
+                if token == b"\\":
+                    if self._pos == len(buffer):
+                        # the escaped byte hasn't arrived yet
+                        self._pos -= 1
+                        break
+                    self._pos += 1
+                elif token == b'"':
+                    self._in_string = False
+            elif token == b'"':
+                self._in_string = True
+            elif token == b"{":
+                if self._depth == 0:
+                    self._start = match.start()
+                self._depth += 1
+            elif token == b"}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        records.append(json.loads(buffer[self._start:self._pos]))
+                    except ValueError as e:
+                        logging.debug(f"skipping malformed record: {e}")
+                    self._start = None
+        self._trim()
+        return records
+
+    def _trim(self):
+        consumed = self._pos if self._start is None else self._start
+        # drop the parsed prefix once it is worth the copy
+        if consumed > 65536 and consumed * 2 > len(self._buffer):
+            del self._buffer[:consumed]
+            self._pos -= consumed
+            if self._start is not None:
+                self._start -= consumed
+
+    @property
+    def remaining(self) -> bytes:
+        """The data after the last complete record, besides whitespace"""
+        consumed = self._pos if self._start is None else self._start
+        return bytes(self._buffer[consumed:]).strip()
@@ -0,0 +1,88 @@
+import logging
+import re
+import sqlite3
+from typing import Optional
+
+from promptops.sqlite_file import SqliteFile
+
+_QUERY_TOKENS = re.compile(r"[\w\-]+")
+# words of the questions that would match almost every fragment
+_STOP_WORDS = frozenset("""
+a an and are as at be by can do does for from how i in is it me my of on or so that the this to what when where
+which who why will with you your
+""".split())
+
+
+class LexicalIndex(object):
+    """
+    BM25 full text index of the fragment texts (sqlite fts5). It matches exact terms like flag names and error
+    messages, which embeddings match poorly, and it works without the backend. Dashes and underscores are part of
+    the tokens, so `--no-verify` or `max_history` are matched as a whole.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = SqliteFile(path, self._setup)
+        self._available = True
+
+    @staticmethod
+    def _setup(conn: sqlite3.Connection):
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS fragments USING fts5(text, tokenize=\"unicode61 tokenchars '-_'\")"
+        )
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if not self._available:
+            return None
+        try:
+            return self._file.connection()
+        except sqlite3.OperationalError as e:
+            # sqlite built without fts5, search by embeddings only
+            logging.debug(f"lexical index not available: {e}")
+            self._available = False
+            return None
+
+    def add(self, texts: list[str]) -> list[Optional[int]]:
+        """
+        :return: the ids of the texts in the index, None when the index is not available
+        """
+        conn = self._connection()
+        if conn is None:
+            return [None] * len(texts)
+        with conn:
+            return [conn.execute("INSERT INTO fragments (text) VALUES (?)", (text,)).lastrowid for text in texts]
+
+    def remove(self, ids: list[int]):
+        conn = self._connection()
+        if conn is None or not ids:
+            return
+        with conn:
+            conn.executemany("DELETE FROM fragments WHERE rowid = ?", [(i,) for i in ids])
+
+    def search(self, query: str, limit: int, min_match: float = 0.0) -> list[tuple[int, float]]:
+        """
+        :param min_match: a text has to contain more than this fraction of the query terms, so a single common
+            word of a longer question doesn't match unrelated texts
+        :return: (id, bm25 score) of the best matching texts, best first. Higher scores are better.
+        """
+        conn = self._connection()
+        tokens = list(dict.fromkeys(
+            token.lower() for token in _QUERY_TOKENS.findall(query) if token.lower() not in _STOP_WORDS
+        ))
+        if conn is None or not tokens:
+            return []
+        match = " OR ".join(f'"{token}"' for token in tokens)
+        try:
+            rows = conn.execute(
+                "SELECT rowid, rank, text FROM fragments WHERE fragments MATCH ? ORDER BY rank LIMIT ?", (match, limit)
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            logging.debug(f"lexical search failed: {e}")
+            return []
+        results = []
+        for rowid, rank, text in rows:
+            terms = set(_QUERY_TOKENS.findall(text.lower()))
+            if sum(token in terms for token in tokens) > min_match * len(tokens):
+                # fts5 ranks are negated bm25 scores
+                results.append((rowid, -rank))
+        return results
@@ -0,0 +1,77 @@
+import os
+import uuid
+from collections import defaultdict
+
+# a reference to a stored text: the generation of the file, the offset and the length in bytes
+TextRef = list
+
+
+class TextStore(object):
+    """
+    Append-only files with the texts of the fragments, so searches only read the texts of the hits instead of
+    decoding all the indexed text. Texts are addressed by TextRef; compact() rewrites the live texts into a new
+    generation once the files are mostly garbage.
+    """
+
+    def __init__(self, dir_name: str, prefix: str):
+        self.dir_name = dir_name
+        self.prefix = prefix
+        self._generation = None
+
+    def _path(self, generation: str) -> str:
+        return os.path.join(self.dir_name, f"{self.prefix}.{generation}.text")
+
+    def generations(self) -> list[str]:
+        if not os.path.exists(self.dir_name):
+            return []
+        prefix = self.prefix + "."
+        return [name[len(prefix):-len(".text")] for name in os.listdir(self.dir_name)
+                if name.startswith(prefix) and name.endswith(".text")]
+
+    def size(self) -> int:
+        return sum(os.path.getsize(self._path(generation)) for generation in self.generations())
+
+    def append(self, texts: list[str]) -> list[TextRef]:
+        """Appends to the most recent generation"""
+        if self._generation is None:
+            generations = self.generations()
+            if generations:
+                self._generation = max(generations, key=lambda g: os.path.getmtime(self._path(g)))
+            else:
+                self._generation = uuid.uuid4().hex[:8]
+        generation = self._generation
+        refs = []
+        with open(self._path(generation), "ab") as f:
+            offset = f.tell()
+            data = []
+            for text in texts:
+                encoded = text.encode("utf-8")
+                refs.append([generation, offset, len(encoded)])
+                offset += len(encoded)
+                data.append(encoded)
+            f.write(b"".join(data))
+        return refs
+
+    def read(self, refs: list[TextRef]) -> list[str]:
+        texts = [""] * len(refs)
+        by_generation = defaultdict(list)
+        for i, ref in enumerate(refs):
+            by_generation[ref[0]].append(i)
+        for generation, indexes in by_generation.items():
+            with open(self._path(generation), "rb") as f:
+                for i in sorted(indexes, key=lambda i: refs[i][1]):
+                    f.seek(refs[i][1])
+                    texts[i] = f.read(refs[i][2]).decode("utf-8")
+        return texts
+
+    def compact(self, texts: list[str]) -> list[TextRef]:
+        """
+        Writes the live texts into a new generation, the old ones stay readable until remove_unused().
+        """
+        self._generation = uuid.uuid4().hex[:8]
+        return self.append(texts)
+
+    def remove_unused(self, used: set[str]):
+        for generation in self.generations():
+            if generation not in used:
+                os.remove(self._path(generation))
@@ -217,8 +217,9 @@ def entry_alias():
                 usage=f"{alias} index [action]",
                 description=f"{alias} index: manage the indexed data",
             )
-            subparser.add_argument("action", choices=["list", "add", "remove", "test"], help="list or update the index")
+            subparser.add_argument("action", choices=["list", "add", "remove", "refresh", "test"], help="list or update the index")
             subparser.add_argument("--source", help="the source to add or remove")
+            subparser.add_argument("--recursive", action="store_true", help="add all markdown files in the source directory")
             subparser.add_argument("--query", help="query to test with")
             sub_args = subparser.parse_args(args.question[1:])
             return index_mode(sub_args)
@@ -283,8 +284,9 @@ def entry_main():
     parser_workflow.set_defaults(func=recipe_mode)
 
     parser_index = subparsers.add_parser("index", help="manage the indexed data")
-    parser_index.add_argument("action", choices=["list", "add", "remove", "test"], help="list or update the index")
+    parser_index.add_argument("action", choices=["list", "add", "remove", "refresh", "test"], help="list or update the index")
     parser_index.add_argument("--source", help="the source to add or remove")
+    parser_index.add_argument("--recursive", action="store_true", help="add all markdown files in the source directory")
     parser_index.add_argument("--query", help="query to test with")
     parser_index.set_defaults(func=index_mode)
 
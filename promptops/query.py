@@ -1,10 +1,8 @@
 from dataclasses import dataclass
 
-import requests
-
+from promptops import client
 from promptops import settings
 from promptops import trace
-from promptops import user
 
 
 @dataclass
@@ -25,13 +23,11 @@ class Result:
 
 
 def query(*, q: str) -> list[Result]:
-    response = requests.post(settings.endpoint + "/query", json={
+    response = client.post("/query", json={
         "query": q,
         "explanation": settings.request_explanation,
         "model": settings.model,
         "trace_id": trace.trace_id,
-    }, headers={
-        "user-agent": f"promptops-cli; user_id={user.user_id}",
     })
     if response.status_code != 200:
         raise Exception(f"there was problem with the response, status: {response.status_code}, text: {response.text}")
@@ -12,8 +12,7 @@ from promptops.loading import Simple
 from prompt_toolkit import print_formatted_text
 from prompt_toolkit.formatted_text import HTML, to_formatted_text
 from typing import Callable
-from promptops import settings
-from promptops.user import user_id
+from promptops import client
 from promptops.trace import trace_id
 from . import messages
 from promptops import scrub_secrets
@@ -28,8 +27,8 @@ def get_explanation(
     history_context: list[str],
     similar_history: list[str],
 ):
-    response = requests.post(
-        settings.endpoint + "/explain",
+    response = client.post(
+        "/explain",
         json={
             "script": result.script,
             "lang": result.lang,
@@ -44,9 +43,6 @@ def get_explanation(
             },
             "trace_id": trace_id,
         },
-        headers={
-            "user-agent": f"promptops-cli; user_id={user_id()}",
-        },
     )
     response.raise_for_status()
     data = response.json()
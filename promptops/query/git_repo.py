@@ -2,7 +2,6 @@ import typing
 import colorama
 import os
 from promptops.ui import selections
-from promptops import gitaware
 from promptops.loading.context import loading_animation
 from promptops.loading.simple import Simple
 from promptops.index import index_store, content
@@ -32,15 +31,7 @@ def _set_processed(git_root):
 
 def _discover_indexable_files(root, accept_file: typing.Callable[[str, str], bool] = None) -> list[str]:
     accept_file = accept_file or (lambda _, fname: fname.lower() == "readme.md")
-    files = []
-    for (dirpath, dirnames, filenames) in os.walk(root):
-        for filename in filenames:
-            full_name = os.path.join(dirpath, filename)
-            if not accept_file(dirpath, filename) or gitaware.is_ignored(full_name):
-                continue
-            files.append(full_name)
-        dirnames[:] = filter(lambda d: d != ".git", dirnames)
-    return files
+    return content.discover_files(root, accept_file)
 
 
 def _pretty_option(root, file, is_selected):
@@ -110,14 +101,14 @@ def offer_to_index(git_root):
     print()
 
     store = index_store.IndexStore(os.path.expanduser(settings.user_index_root))
-    indexed_files = {item.item_location for item in store.metadata if item.item_type == "file"}
+    to_index = []
     for (file, is_selected) in zip(files, selected):
         if is_selected:
-            print("indexing:", os.path.relpath(file, git_root))
-            if file not in indexed_files:
-                meta, db = content.index_file(file)
-                store.add_or_update(meta, db)
+            if store.find("file", file) is None:
+                to_index.append(file)
             else:
-                print("  already indexed")
+                print("already indexed:", os.path.relpath(file, git_root))
+    if to_index:
+        store.add_or_update_many(content.index_files(to_index, store))
 
     return
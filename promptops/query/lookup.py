@@ -5,9 +5,7 @@ import sys
 import threading
 import queue
 
-import requests
-
-from promptops import user, settings, trace
+from promptops import client, trace
 from promptops.feedback import feedback
 
 from promptops.similarity import embedding
@@ -144,7 +142,6 @@ class App:
                 value = embedding(text=item)
 
                 hist_items = self._hist_db.search(value, min_similarity=0.1, k=self._max_items)
-                hist_items = [(obj, score) for obj, score in hist_items if not isinstance(obj, dict) or not obj.get("ignore", False)]
                 hist_items = [(r if isinstance(r, str) else r["cmd"], score) for r, score in hist_items]
                 corr_items = self._corrections_db.search(value, min_similarity=0.1, k=self._max_items)
                 corr_items = [(r["corrected"], score) for r, score in corr_items]
@@ -285,12 +282,9 @@ def lookup_curated(q: str) -> list[tuple[str, int]]:
         "shell": os.environ.get("SHELL"),
     }
     logging.debug("curated query with request: %s", req)
-    response = requests.post(
-        settings.endpoint + "/curated",
+    response = client.post(
+        "/curated",
         json=req,
-        headers={
-            "user-agent": f"promptops-cli; user_id={user.user_id()}",
-        },
     )
     if response.status_code != 200:
         # this exception completely destroys the ui
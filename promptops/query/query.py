@@ -17,9 +17,9 @@ from prompt_toolkit.patch_stdout import patch_stdout
 from prompt_toolkit.formatted_text import HTML, to_formatted_text
 from promptops.shells import get_shell
 
+from promptops import client
 from promptops import settings
 from promptops import trace
-from promptops import user
 from promptops.ui import prompts
 from promptops.ui import selections
 from promptops.loading import Simple, loading_animation
@@ -93,7 +93,7 @@ def corrections_search(embedding):
     return list(filter(lambda c: c[0].corrected is not None, [(corrections.QATuple.from_dict(s), score) for s, score in similar]))
 
 
-def search_indexed_fragments(embedding, current_dir: str) -> list[index_store.SearchResult]:
+def search_indexed_fragments(embedding, current_dir: str, question: str = None) -> list[index_store.SearchResult]:
     store = index_store.IndexStore(os.path.expanduser(settings.user_index_root))
 
     def accept_source(meta: index_store.ItemMetadata):
@@ -102,7 +102,7 @@ def search_indexed_fragments(embedding, current_dir: str) -> list[index_store.Se
         dirname = os.path.dirname(meta.item_location)
         return current_dir.startswith(dirname)
 
-    similar = store.search(embedding, k=3, min_similarity=0.7, accept_source=accept_source)
+    similar = store.search(embedding, k=3, min_similarity=0.7, accept_source=accept_source, query=question)
     return similar
 
 
@@ -157,7 +157,7 @@ def revise_loop(questions: list[str], prev_results: list[list[str]], history_con
     results = corrected_results + history_results
     results = deduplicate(results)
 
-    relevant_indexed_data = search_indexed_fragments(embedding, os.getcwd())
+    relevant_indexed_data = search_indexed_fragments(embedding, os.getcwd(), "\n".join(questions))
     if len(relevant_indexed_data) > 0:
         print("  found information that might be relevant to your question in:")
         printed = set()
@@ -256,10 +256,11 @@ def revise_loop(questions: list[str], prev_results: list[list[str]], history_con
                     options += [make_revise_option()]
                 ui.reset_options(options, is_loading=num_running > 0)
         hdb = history.get_history_db()
-        for item in hdb.objects:
-            if isinstance(item, dict) and item["cmd"] == result.script:
-                item["ignore"] = True
-        hdb.save(os.path.expanduser(settings.history_db_path))
+        row = hdb.find(result.script)
+        if row is not None and isinstance(hdb.objects[row], dict):
+            hdb.objects[row]["ignore"] = True
+            hdb.reindex(row)
+            hdb.commit(os.path.expanduser(settings.history_db_path), [row])
 
     # wait for threads to finish one by one until we get the first non-empty result
     with loading_animation(Simple("thinking...")):
@@ -450,9 +451,9 @@ def do_query(question: str):
         db = corrections.get_db()
         q = "\n".join(questions)
         vector = similarity.embedding(text=q)
-        db.update_or_add(vector, corrections.QATuple(question=q, answer=cmd.script, corrected=confirmed).to_dict(), equals=lambda a, b: a["question"] == b["question"])
+        row = db.update_or_add(vector, corrections.QATuple(question=q, answer=cmd.script, corrected=confirmed).to_dict())
         logging.debug("added correction to db")
-        db.save(os.path.expanduser(settings.corrections_db_path))
+        db.commit(os.path.expanduser(settings.corrections_db_path), [row])
         feedback({"event": "corrected"})
 
     feedback({"event": "run"})
@@ -471,9 +472,9 @@ def do_query(question: str):
             db = corrections.get_db()
             q = "\n".join(questions)
             vector = similarity.embedding(text=q)
-            db.update_or_add(vector, corrections.QATuple(question=q, answer=cmd.script, corrected=corrected_cmd.script).to_dict(), equals=lambda a, b: a["question"] == b["question"])
+            row = db.update_or_add(vector, corrections.QATuple(question=q, answer=cmd.script, corrected=corrected_cmd.script).to_dict())
             logging.debug("added correction to db")
-            db.save(os.path.expanduser(settings.corrections_db_path))
+            db.commit(os.path.expanduser(settings.corrections_db_path), [row])
         feedback({"event": "finished", "rc": rc, "corrected": True})
 
 
@@ -511,12 +512,9 @@ def query(
         "shell": os.environ.get("SHELL"),
     }
     logging.debug("query with request: %s", req)
-    response = requests.post(
-        settings.endpoint + "/query",
+    response = client.post(
+        "/query",
         json=req,
-        headers={
-            "user-agent": f"promptops-cli; user_id={user.user_id()}",
-        },
     )
     if response.status_code != 200:
         # this exception completely destroys the ui
@@ -546,12 +544,9 @@ def curated(*, q: str) -> list[Result]:
         "shell": os.environ.get("SHELL"),
     }
     logging.debug("curated query with request: %s", req)
-    response = requests.post(
-        settings.endpoint + "/curated",
+    response = client.post(
+        "/curated",
         json=req,
-        headers={
-            "user-agent": f"promptops-cli; user_id={user.user_id()}",
-        },
     )
     if response.status_code != 200:
         # this exception completely destroys the ui
@@ -2,9 +2,8 @@ import fnmatch
 import logging
 import os
 
-import requests
 from typing import List
-from promptops import shells, settings, user, trace
+from promptops import shells, client, trace
 import shlex
 from thefuzz import fuzz
 
@@ -174,16 +173,13 @@ def suggest_next_gpt() -> List[dict]:
     context.reverse()
     files = get_files()
 
-    response = requests.post(
-        settings.endpoint + "/skills/predict",
+    response = client.post(
+        "/skills/predict",
         json={
             "trace_id": trace.trace_id,
             "previous_commands": context,
             "files": files
         },
-        headers={
-            "user-agent": f"promptops-cli; user_id={user.user_id()}",
-        },
     )
 
     if response.status_code != 200 or not response.json().get("options"):
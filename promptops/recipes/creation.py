@@ -10,7 +10,7 @@ import requests
 import sys
 
 from typing import Optional
-from promptops import settings
+from promptops import client
 from promptops import trace
 from promptops import user
 from promptops.feedback import feedback
@@ -75,12 +75,9 @@ def regenerate_recipe_execution(recipe, clarification, error=None, loading=None)
     if error:
         req['error'] = error
 
-    response = requests.post(
-        settings.endpoint + "/recipe/stream/regenerate",
+    response = client.post(
+        "/recipe/stream/regenerate",
         json=req,
-        headers={
-            "user-agent": f"promptops-cli; user_id={user.user_id()}",
-        },
         stream=True
     )
     recipe['execution'] = []
@@ -95,12 +92,9 @@ def get_recipe_execution(recipe: dict, loading=None):
         "id": recipe['id'],
     }
 
-    response = requests.post(
-        settings.endpoint + "/recipe/stream/execution",
+    response = client.post(
+        "/recipe/stream/execution",
         json=req,
-        headers={
-            "user-agent": f"promptops-cli; user_id={user.user_id()}",
-        },
         stream=True
     )
 
@@ -117,10 +111,9 @@ def clarify_steps(recipe, clarification, loading=None):
         "clarification": clarification,
     }
 
-    response = requests.post(
-        settings.endpoint + "/recipe/stream/clarify",
+    response = client.post(
+        "/recipe/stream/clarify",
         json=req,
-        headers={"user-agent": f"promptops-cli; user_id={user.user_id()}"},
         stream=True
     )
 
@@ -172,12 +165,9 @@ def init_recipe(prompt: str, language: str, workflow_id=None, loading=None):
     if language == LANG_SHELL:
         req['shell'] = os.environ.get("SHELL")
 
-    response = requests.post(
-        settings.endpoint + "/recipe/stream/init",
+    response = client.post(
+        "/recipe/stream/init",
         json=req,
-        headers={
-            "user-agent": f"promptops-cli; user_id={user.user_id()}",
-        },
         stream=True
     )
 
@@ -220,13 +210,14 @@ def get_recipe(prompt: str, language: str, workflow_id=None):
     if language == LANG_SHELL:
         req['shell'] = os.environ.get("SHELL")
 
-    response = requests.post(
-        settings.endpoint + "/recipe/init",
-        json=req,
-        headers={
-            "user-agent": f"promptops-cli; user_id={user.user_id()}",
-        },
-    )
+    try:
+        response = client.post(
+            "/recipe/init",
+            json=req,
+        )
+    except requests.RequestException as e:
+        logging.debug(f"failed to get the recipe: {e}")
+        return print("an error occurred retrieving the recipe")
 
     if response.status_code == 404:
         return print("recipe not found")
@@ -292,12 +283,9 @@ def save_steps(recipe):
         'steps': recipe.get('steps')
     }
 
-    response = requests.post(
-        settings.endpoint + "/recipe/steps",
+    response = client.post(
+        "/recipe/steps",
         json=req,
-        headers={
-            "user-agent": f"promptops-cli; user_id={user.user_id()}",
-        }
     )
 
     if response.status_code != 200:
@@ -345,12 +333,9 @@ def save_flow(recipe):
         'execution': recipe.get('execution')
     }
 
-    response = requests.post(
-        settings.endpoint + "/recipe/save",
+    response = client.post(
+        "/recipe/save",
         json=req,
-        headers={
-            "user-agent": f"promptops-cli; user_id={user.user_id()}",
-        }
     )
 
     if response.status_code != 200:
@@ -359,9 +344,7 @@ def save_flow(recipe):
 
 
 def list_recipes():
-    response = requests.get(settings.endpoint + f"/recipe?trace_id={trace.trace_id}", headers={
-            "user-agent": f"promptops-cli; user_id={user.user_id()}",
-    })
+    response = client.get(f"/recipe?trace_id={trace.trace_id}")
 
     if response.status_code != 200:
         print("error", response.json(), "code", response.status_code)
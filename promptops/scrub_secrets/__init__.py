@@ -1 +1 @@
-from .scrub import scrub_file, scrub_lines, scrub_line
+from .scrub import scrub_file, scrub_lines, scrub_line, scrub_stream
@@ -1,3 +1,6 @@
+from itertools import islice
+from typing import Iterable, Iterator
+
 from detect_secrets import SecretsCollection
 from detect_secrets.settings import default_settings
 
@@ -50,6 +53,9 @@ def scan_lines(fake_filename: str, lines: list[str]):
         )
 
 
+# lines scrubbed at once by scrub_stream
+SCRUB_WINDOW = 1000
+
 _PADDING = [
     "echo hello world",
     "cat test > test.txt",
@@ -71,5 +77,18 @@ def scrub_lines(fake_filename: str, lines: list[str]) -> list[str]:
     return scrubbed
 
 
+def scrub_stream(fake_filename: str, lines: Iterable[str], window: int = SCRUB_WINDOW) -> Iterator[str]:
+    """
+    Scrubs the lines a window at a time, so a long history is never held in memory at once. A secret that is
+    only detected from the lines around it can be missed at the edges of a window.
+    """
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, window))
+        if not chunk:
+            return
+        yield from scrub_lines(fake_filename, chunk)
+
+
 def scrub_line(fake_filename: str, line: str) -> str:
     return scrub_lines(fake_filename, [line])[0]
@@ -1,4 +1,6 @@
 DEFAULT_ENDPOINT = "https://cli.promptops.com"
+DEFAULT_EMBEDDINGS_CACHE_SIZE = 64 * 1024 * 1024
+DEFAULT_INDEX_CACHE_SIZE = 256 * 1024 * 1024
 
 endpoint: str = DEFAULT_ENDPOINT
 request_explanation: bool = True
@@ -6,6 +8,7 @@ model: str = "accurate"
 history_context: int = 0
 corrections_db_path = "~/.promptops/corrections.db"
 history_db_path = "~/.promptops/history.db"
+history_checkpoints_path = "~/.promptops/history_checkpoints.json"
 user_id_path = "~/.promptops/user_id"
 index_history: bool = False
 user_index_root = "~/.promptops/index"
@@ -13,3 +16,7 @@ temp_history_file = "~/.promptops/temp_history"
 gen_commit_message = None
 version_check_file = "~/.promptops/version_check"
 show_changes_frequency = 60 * 60 * 24 * 7
+embeddings_cache_path = "~/.promptops/embeddings.cache"
+embeddings_cache_size = DEFAULT_EMBEDDINGS_CACHE_SIZE
+compress_requests: bool = True
+index_cache_size = DEFAULT_INDEX_CACHE_SIZE
@@ -28,6 +28,9 @@ def load():
     settings.history_db_path = data.get("history_db_path", settings.history_db_path)
     settings.index_history = data.get("index_history", settings.index_history)
     settings.gen_commit_message = data.get("gen_commit_message", settings.gen_commit_message)
+    settings.compress_requests = data.get("compress_requests", settings.compress_requests)
+    settings.embeddings_cache_size = data.get("embeddings_cache_size", settings.embeddings_cache_size)
+    settings.index_cache_size = data.get("index_cache_size", settings.index_cache_size)
 
 
 def _build_data():
@@ -42,6 +45,12 @@ def _build_data():
     }
     if settings.endpoint != settings.DEFAULT_ENDPOINT:
         data["endpoint"] = settings.endpoint
+    if not settings.compress_requests:
+        data["compress_requests"] = False
+    if settings.embeddings_cache_size != settings.DEFAULT_EMBEDDINGS_CACHE_SIZE:
+        data["embeddings_cache_size"] = settings.embeddings_cache_size
+    if settings.index_cache_size != settings.DEFAULT_INDEX_CACHE_SIZE:
+        data["index_cache_size"] = settings.index_cache_size
     return data
 
 
@@ -1,7 +1,9 @@
 import re
 import os
 from abc import ABC, abstractmethod
-from promptops.scrub_secrets import scrub_lines
+from itertools import chain
+from typing import Callable, Iterator
+from promptops.scrub_secrets import scrub_lines, scrub_stream
 from promptops import settings
 
 
@@ -32,92 +34,62 @@ def filter_commands(commands: list[str]):
     return filter(accept_command, commands)
 
 
+def _decode_lines(data: bytes, transform: callable = None) -> str:
+    if transform is not None:
+        data, _ = transform(data)
+    return data.decode("utf-8", errors="ignore")
+
+
 def reverse_readline(filename, buf_size=8192, transform: callable = None):
-    """A generator that returns the lines of a file in reverse order"""
+    """
+    A generator that returns the lines of a file in reverse order. The blocks are cut at new lines before they are
+    transformed and decoded, so neither a metafied nor a multi-byte character is split between two blocks.
+    """
     with open(filename, "rb") as fh:
-        segment = None
-        offset = 0
         fh.seek(0, os.SEEK_END)
-        file_size = remaining_size = fh.tell()
-        extra = b""
-        while remaining_size > 0:
-            offset = min(file_size, offset + buf_size)
-            fh.seek(file_size - offset)
-            block = fh.read(min(remaining_size, buf_size)) + extra
-            remaining_size -= buf_size
-
-            if transform is not None:
-                block, extra_transform = transform(block)
-            else:
-                extra_transform = b""
-
-            for i in range(min(8, len(block))):
-                try:
-                    buffer = block[i:].decode(encoding="utf-8")
-                    extra = block[:i] + extra_transform
-                    break
-                except UnicodeDecodeError:
-                    continue
-            else:
-                extra = block + extra_transform
+        position = fh.tell()
+        if position == 0:
+            return
+        # the beginning of the earliest line read so far, the rest of it is in the block before
+        segment = b""
+        while position > 0:
+            size = min(buf_size, position)
+            position -= size
+            fh.seek(position)
+            block = fh.read(size) + segment
+            first = block.find(b"\n")
+            if first < 0:
+                segment = block
                 continue
-            lines = buffer.split("\n")
-            # The first line of the buffer is probably not a complete line so
-            # we'll save it and append it to the last line of the next buffer
-            # we read
-            if segment is not None:
-                # If the previous chunk starts right from the beginning of line
-                # do not concat the segment to the last line of new chunk.
-                # Instead, yield the segment first
-                if buffer[-1] != "\n":
-                    lines[-1] += segment
-                else:
-                    lines = lines[:-1]
-                    yield segment
-            segment = lines[0]
-            # iterate in reverse
-            for index in range(len(lines) - 1, 0, -1):
-                yield lines[index]
-        # Don't yield None if the file was empty
-        if segment is not None:
-            yield segment
+            segment = block[:first]
+            yield from reversed(_decode_lines(block[first + 1:], transform).split("\n"))
+        yield _decode_lines(segment, transform)
 
 
-def readline(filename, buf_size=8192, transform: callable = None):
+def readline(filename, buf_size=8192, transform: callable = None, on_read: callable = None):
+    """
+    A generator that returns the lines of a file, on_read is called with the size of every block read. The blocks
+    are cut at new lines before they are transformed and decoded, see reverse_readline().
+    """
     with open(filename, "rb") as fh:
+        # the end of the latest line read so far, the rest of it is in the next block
         segment = None
-        extra = b""
         while True:
             data = fh.read(buf_size)
             if not data:
                 break
-            block = extra + data
-            if transform is not None:
-                block, extra_transform = transform(block)
-            else:
-                extra_transform = b""
-            for i in range(min(8, len(block))):
-                try:
-                    buffer = block[i:].decode(encoding="utf-8")
-                    extra = block[:i] + extra_transform
-                    break
-                except UnicodeDecodeError:
-                    continue
-            else:
-                extra = block + extra_transform
+            if on_read is not None:
+                on_read(len(data))
+            block = data if segment is None else segment + data
+            last = block.rfind(b"\n")
+            if last < 0:
+                segment = block
                 continue
-            lines = buffer.split("\n")
-            # The last line of the buffer is probably not a complete line so
-            # we'll save it and append it to the first line of the next buffer
-            # we read
-            if segment is not None:
-                lines[0] = segment + lines[0]
-            for line in lines[:-1]:
-                yield line
-            segment = lines[-1]
-        # Don't yield None if the file was empty
+            segment = block[last + 1:]
+            yield from _decode_lines(block[:last], transform).split("\n")
+        # Don't yield anything if the file was empty
         if segment is not None:
-            yield segment
+            yield _decode_lines(segment, transform)
 
 
 _extra_history = []
@@ -149,14 +121,60 @@ class Shell(ABC):
         raise NotImplementedError()
 
     def get_full_history(self):
-        history = self._read_history_file()
-        cmds = self._get_cmds_from_lines(history)
-        return scrub_lines(self.history_file, list(filter_commands(cmds + _extra_history)))
-
-    def _read_history_file(self):
+        return list(self.iter_full_history())
+
+    def iter_full_history(self, on_read: Callable[[int], None] = None) -> Iterator[str]:
+        """
+        Streams the scrubbed commands of the full history. The history file is read, parsed, filtered and scrubbed
+        a bit at a time, so it is never held in memory at once.
+        :param on_read: called with the number of bytes of the history file read, to report the progress
+        """
+        cmds = self._get_cmds_from_lines(self._iter_history_file(on_read))
+        return scrub_stream(self.history_file, filter_commands(chain(cmds, _extra_history)))
+
+    def get_history_since(self, offset: int) -> tuple[list[str], int]:
+        """
+        Reads the commands appended to the history file after a previous read.
+        :param offset: byte offset in the history file where the previous read stopped
+        :return: the commands of the complete records after the offset, and the offset after the last of them
+        """
+        fname = os.path.expanduser(self.history_file)
+        with open(fname, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = self._records_end(data)
+        cmds = self._get_cmds_from_lines(self._decode_history(data[:end]))
+        return scrub_lines(self.history_file, list(filter_commands(cmds))), offset + end
+
+    def _records_end(self, data: bytes) -> int:
+        """
+        :return: the length of the complete records at the start of data, a record that is still being written
+            or that is continued on a line which isn't there yet is left for the next read
+        """
+        end = data.rfind(b"\n")
+        while end >= 0:
+            start = data.rfind(b"\n", 0, end)
+            if not self._is_continued(data[start + 1:end].rstrip(b"\r")):
+                return end + 1
+            end = start
+        return 0
+
+    def _is_continued(self, line: bytes) -> bool:
+        return line.endswith(b"\\")
+
+    def _decode_history(self, data: bytes) -> list[str]:
+        lines = data.decode("utf-8", errors="ignore").split("\n")
+        return [line.strip() for line in lines if line.strip() != ""]
+
+    def _iter_history_file(self, on_read: Callable[[int], None] = None) -> Iterator[str]:
         fname = os.path.expanduser(self.history_file)
-        with open(fname, "r", encoding="utf-8", errors="ignore") as f:
-            return [line.strip() for line in f if line.strip() != ""]
+        with open(fname, "rb") as f:
+            for data in f:
+                if on_read is not None:
+                    on_read(len(data))
+                line = data.decode("utf-8", errors="ignore").strip()
+                if line != "":
+                    yield line
 
     def add_to_history(self, script):
         _extra_history.append(script)
@@ -210,6 +228,12 @@ class NoopShell(Shell):
     def get_full_history(self):
         return scrub_lines("~/.bash_history", list(filter_commands(_extra_history)))
 
+    def iter_full_history(self, on_read: Callable[[int], None] = None) -> Iterator[str]:
+        return iter(self.get_full_history())
+
+    def get_history_since(self, offset: int) -> tuple[list[str], int]:
+        return self.get_full_history(), 0
+
     def add_to_history(self, script):
         pass
 
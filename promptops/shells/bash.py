@@ -34,13 +34,11 @@ class Bash(Shell):
 
     def _get_cmds_from_lines(self, lines):
         buffer = ""
-        commands = []
         for line in lines:
             buffer += "\n" + line.rstrip()
             if not line.endswith("\\"):
-                commands.append(buffer.lstrip())
+                yield buffer.lstrip()
                 buffer = ""
-        return commands
 
     def get_config(self):
         return f"""
@@ -22,7 +22,6 @@ class Fish(Shell):
         super().__init__(history_file)
 
     def _get_cmds_from_lines(self, lines):
-        commands = []
         for line in lines:
             if _is_start_line(line):
                 cmd = line.split("- cmd: ")[1].rstrip()
@@ -30,10 +29,13 @@ class Fish(Shell):
                 try:
                     cmd = cmd.encode("latin-1", "backslashreplace").decode("unicode-escape")
                     if accept_command(cmd):
-                        commands.append(cmd)
+                        yield cmd
                 except UnicodeDecodeError:
                     logging.debug("UnicodeDecodeError at line: ", line)
-        return commands
+
+    def _is_continued(self, line: bytes) -> bool:
+        # the command is on a single line, the lines after it only hold its metadata
+        return False
 
     def get_recent_history(self, look_back: int = 10):
         fname = os.path.expanduser(self.history_file)
@@ -1,30 +1,43 @@
 import re
+from itertools import chain
+from typing import Callable, Iterator
 
 from promptops.shells.base import Shell, accept_command, reverse_readline, readline
-from promptops.scrub_secrets import scrub_lines
+from promptops.scrub_secrets import scrub_lines, scrub_stream
 import os
 
 
+_zsh_start_line = re.compile(r"^: \d+:\d+;.+")
+
+
 def _is_zsh_start_line(line):
-    return re.match(r"^: \d+:\d+;.+", line) is not None
+    return _zsh_start_line.match(line) is not None
 
 
 _meta_char = 0x83
+_meta = bytes([_meta_char])
+# a metafied byte is the meta character followed by the original byte xor 32
+_unmeta_table = bytes(b ^ 32 for b in range(256))
+_meta_pair = re.compile(re.escape(_meta) + b".", re.DOTALL)
 
 
 def unmetafy(cmd: bytes) -> (bytes, bytes):
-    i = 0
-    result = b""
-    while i < len(cmd):
-        if cmd[i] == _meta_char:
-            if i + 1 >= len(cmd):
-                return result, cmd[i:]
-            result += bytes([cmd[i+1] ^ 32])
-            i += 1
-        else:
-            result += cmd[i: i+1]
-        i += 1
-    return result, b""
+    """
+    Decodes a block of a metafied zsh history file. The work is done by bytes.split and bytes.translate over the
+    whole block, a block without meta characters is returned as is.
+    :return: the decoded bytes, and a meta character at the end whose byte is in the next block
+    """
+    if _meta not in cmd:
+        return cmd, b""
+    rest = b""
+    # the meta characters pair up from the start of a run, an odd run at the end is missing its last byte
+    if (len(cmd) - len(cmd.rstrip(_meta))) % 2:
+        cmd, rest = cmd[:-1], cmd[-1:]
+    if _meta * 2 in cmd:
+        # a metafied meta character, zsh doesn't write those but they would break the split below
+        return _meta_pair.sub(lambda m: bytes([m.group()[1] ^ 32]), cmd), rest
+    parts = cmd.split(_meta)
+    return parts[0] + b"".join([part[:1].translate(_unmeta_table) + part[1:] for part in parts[1:]]), rest
 
 
 class Zsh(Shell):
@@ -72,41 +85,46 @@ class Zsh(Shell):
                     buffer = "\n" + line
         return scrub_lines(fname, list(reversed(commands)))
 
-    def get_full_history(self):
+    def _decode_history(self, data: bytes) -> list[str]:
+        # metafied bytes never contain a backslash or a new line, so the records can be cut before unmetafying
+        data, _ = unmetafy(data)
+        return data.decode("utf-8", errors="ignore").split("\n")
+
+    def iter_full_history(self, on_read: Callable[[int], None] = None) -> Iterator[str]:
         fname = os.path.expanduser(self.history_file)
-        lines = list(readline(fname, transform=unmetafy))
+        lines = readline(fname, transform=unmetafy, on_read=on_read)
         commands = filter(accept_command, self._get_cmds_from_lines(lines))
-        return scrub_lines(fname, list(commands) + list(filter(accept_command, self._get_added_history())))
+        return scrub_stream(fname, chain(commands, filter(accept_command, self._get_added_history())))
 
     def _get_cmds_from_lines(self, lines):
         buffer = ""
-        commands = []
-        # find the index of the last non-empty line
-        i = len(lines) - 1
-        for i in range(len(lines) - 1, -1, -1):
-            if lines[i] != "":
-                break
-        for line in lines[:i+1]:
-            if _is_zsh_start_line(line):
-                if buffer != "":
-                    commands.append(buffer)
-                buffer = line.split(";")[1].rstrip()
-                if buffer.endswith("\\"):
-                    buffer = buffer[:-1]
-            else:
-                line = line.rstrip()
-                if line.endswith("\\"):
-                    buffer += "\n" + line[:-1]
+        # empty lines are held back until the next non-empty one, the ones at the end are dropped
+        held = 0
+        for next_line in lines:
+            if next_line == "":
+                held += 1
+                continue
+            pending, held = ([""] * held + [next_line] if held else (next_line,)), 0
+            for line in pending:
+                if _is_zsh_start_line(line):
+                    if buffer != "":
+                        yield buffer
+                    buffer = line.split(";")[1].rstrip()
+                    if buffer.endswith("\\"):
+                        buffer = buffer[:-1]
                 else:
-                    if buffer:
-                        buffer = buffer.lstrip("\n")
-                        commands.append(buffer + "\n" + line)
+                    line = line.rstrip()
+                    if line.endswith("\\"):
+                        buffer += "\n" + line[:-1]
                     else:
-                        commands.append(line.lstrip("\n"))
-                    buffer = ""
+                        if buffer:
+                            buffer = buffer.lstrip("\n")
+                            yield buffer + "\n" + line
+                        else:
+                            yield line.lstrip("\n")
+                        buffer = ""
         if buffer != "" and not buffer.endswith("\\"):
-            commands.append(buffer.lstrip("\n"))
-        return commands
+            yield buffer.lstrip("\n")
 
     def get_config(self):
         return f"""
@@ -0,0 +1,886 @@
+import base64
+import json
+import logging
+import os.path
+import threading
+import uuid
+from typing import Optional, Iterable, Callable, Hashable
+
+import numpy as np
+
+from promptops import client
+from functools import lru_cache
+from promptops import trace
+from .ivf import IVFIndex
+from .quantization import quantize, approximate_scores
+from .cache import get_cache, cache_key
+from .dispatcher import EmbeddingDispatcher
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Returns the indices of the k highest scores, best first. Only the selected k scores get sorted.
+    """
+    if k <= 0:
+        return np.zeros(0, dtype=int)
+    if k >= len(scores):
+        return np.argsort(scores)[::-1]
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(scores[top])[::-1]]
+
+
+class VectorDB(object):
+    def __init__(
+        self,
+        key: Callable[[object], Hashable] = None,
+        exclude: Callable[[object], bool] = None,
+        quantized: bool = False,
+        dtype=np.float32,
+    ):
+        """
+        :param key: optional function that maps an object to a unique key. When set, the db keeps a dict from
+            key to row, so find(), update_or_add() and membership checks don't have to scan the objects.
+        :param exclude: optional predicate for objects that should never be returned by the searches, e.g. ignored
+            history entries. Call reindex() after modifying an object in place.
+        :param quantized: also keep int8 codes of the vectors. Searches scan the codes and re-score a shortlist
+            with the full vectors, so only the shortlisted rows of the (memory-mapped) vectors are read.
+        :param dtype: dtype of the stored vectors, other dtypes are converted when added or loaded
+        """
+        self.key = key
+        self.exclude = exclude
+        self.quantized = quantized
+        self.dtype = np.dtype(dtype)
+        self._codes: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._rows_by_key: Optional[dict] = None
+        # the matrix mapped by load(), rows appended after it (e.g. replayed from the journal) go to _vectors,
+        # so the mapping is never copied to grow it
+        self._base: Optional[np.ndarray] = None
+        # rows past self._size are spare capacity, so appends are amortized O(1)
+        self._vectors = np.zeros((0, 0), dtype=self.dtype)
+        self._size = 0
+        # removed rows are only tombstoned until the next compact(), _hidden adds the excluded rows on top
+        self._deleted = np.zeros(0, dtype=bool)
+        self._dead = 0
+        self._hidden = np.zeros(0, dtype=bool)
+        self._hidden_valid = False
+        self._pending_deletes: list[int] = []
+        # approximate index, only maintained for dbs with at least ANN_MIN_ROWS rows
+        self._ann: Optional[IVFIndex] = None
+        self._objects = []
+        # serialized objects from the sidecar file, decoded on first access together with the objects appended
+        # and the updates made to its rows until then
+        self._objects_raw: Optional[bytes] = None
+        self._raw_rows = 0
+        self._raw_updates: dict[int, object] = {}
+        self._raw_tail: list = []
+        # stable row ids, the journal refers to rows by id because positions differ between processes. The ids
+        # of the loaded (or assigned) rows are read from the file or derived from _id_prefix, _ids holds the rest
+        self._file_ids: Optional[np.ndarray] = None
+        self._file_id_rows = 0
+        self._id_prefix = uuid.uuid4().hex
+        self._ids: list[str] = []
+        self._rows_by_id: Optional[dict] = None
+        # journal bookkeeping, see commit()
+        self._generation: Optional[str] = None
+        self._persisted_rows = 0
+        self._journal_records = 0
+        self._journal_offset = 0
+        self._journal_in_sync = True
+
+    @property
+    def objects(self) -> list:
+        if self._objects_raw is not None:
+            self._objects = json.loads(self._objects_raw)
+            for row, obj in self._raw_updates.items():
+                self._objects[row] = obj
+            self._objects.extend(self._raw_tail)
+            self._objects_raw = None
+            self._raw_updates = {}
+            self._raw_tail = []
+        return self._objects
+
+    @objects.setter
+    def objects(self, objects: list):
+        self._objects = objects
+        self._objects_raw = None
+        self._raw_updates = {}
+        self._raw_tail = []
+        self._rows_by_key = None
+
+    def _object(self, row: int):
+        if self._objects_raw is None:
+            return self._objects[row]
+        if row >= self._raw_rows:
+            return self._raw_tail[row - self._raw_rows]
+        return self._raw_updates[row] if row in self._raw_updates else self.objects[row]
+
+    def _set_object(self, row: int, obj):
+        if self._objects_raw is None:
+            self._objects[row] = obj
+        elif row < self._raw_rows:
+            self._raw_updates[row] = obj
+        else:
+            self._raw_tail[row - self._raw_rows] = obj
+        self.reindex(row)
+
+    def _key_index(self) -> dict:
+        if self._rows_by_key is None:
+            self._rows_by_key = {}
+            for i, obj in enumerate(self.objects):
+                if not self._deleted[i]:
+                    self._rows_by_key.setdefault(self.key(obj), i)
+        return self._rows_by_key
+
+    def find(self, key: Hashable) -> Optional[int]:
+        """
+        :return: the row of the object with the given key, None if there is no such object
+        """
+        if self.key is None:
+            raise ValueError("find requires a db with a key function")
+        return self._key_index().get(key)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        base_rows = self._base_rows()
+        if base_rows == 0:
+            return self._vectors[:self._size]
+        if base_rows == self._size:
+            return self._base
+        # the whole matrix is asked for, join the appended rows to the mapped ones once
+        self._vectors = np.concatenate((self._base, self._vectors[:self._size - base_rows]))
+        self._base = None
+        return self._vectors
+
+    @vectors.setter
+    def vectors(self, vectors: np.ndarray):
+        if vectors.dtype != self.dtype:
+            vectors = vectors.astype(self.dtype)
+        self._base = None
+        self._vectors = vectors
+        self._size = len(vectors)
+        self._codes = None
+        self._scales = None
+        self._deleted = np.zeros(len(vectors), dtype=bool)
+        self._dead = 0
+        self._hidden = np.zeros(len(vectors), dtype=bool)
+        self._hidden_valid = False
+        self._ann = None
+        self._file_ids = None
+        self._file_id_rows = len(vectors)
+        self._id_prefix = uuid.uuid4().hex
+        self._ids = []
+        self._rows_by_id = None
+
+    def _row_id(self, row: int) -> str:
+        if row >= self._file_id_rows:
+            return self._ids[row - self._file_id_rows]
+        if self._file_ids is None:
+            # every process derives the same ids for a db file that has none stored
+            return f"{self._id_prefix}:{row}"
+        return str(self._file_ids[row])
+
+    def _id_index(self) -> dict:
+        if self._rows_by_id is None:
+            self._rows_by_id = {self._row_id(i): i for i in range(self._size)}
+        return self._rows_by_id
+
+    def _base_rows(self) -> int:
+        return 0 if self._base is None else len(self._base)
+
+    def _segments(self, start: int = 0) -> list[np.ndarray]:
+        """
+        :return: the stored rows from start on, as views of the mapped matrix and of the appended rows
+        """
+        base_rows = self._base_rows()
+        segments = [self._base[start:]] if start < base_rows else []
+        if self._size > max(start, base_rows):
+            segments.append(self._vectors[max(start - base_rows, 0):self._size - base_rows])
+        return segments
+
+    def _rows_from(self, start: int) -> np.ndarray:
+        segments = self._segments(start)
+        return segments[0] if len(segments) == 1 else np.concatenate(segments)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the stored vectors, without joining the rows appended after a load like vectors does"""
+        return sum(segment.nbytes for segment in self._segments())
+
+    def vectors_at(self, rows) -> np.ndarray:
+        """
+        :return: the vectors of the given rows, without joining the rows appended after a load like vectors does
+        """
+        rows = np.asarray(rows, dtype=int)
+        base_rows = self._base_rows()
+        if base_rows == 0:
+            return self._vectors[rows]
+        in_base = rows < base_rows
+        if in_base.all():
+            return self._base[rows]
+        result = np.empty((len(rows), self._base.shape[1]), dtype=self.dtype)
+        result[in_base] = self._base[rows[in_base]]
+        result[~in_base] = self._vectors[rows[~in_base] - base_rows]
+        return result
+
+    def _reserve(self, rows: int, dim: int):
+        if self._size == 0 and self._vectors.shape[1:] != (dim,):
+            self._vectors = np.empty((max(rows, 16), dim), dtype=self.dtype)
+            self._deleted = np.zeros(len(self._vectors), dtype=bool)
+            self._hidden = np.zeros(len(self._vectors), dtype=bool)
+            return
+        base_rows = self._base_rows()
+        appended = self._size - base_rows
+        capacity = len(self._vectors)
+        if appended + rows <= capacity:
+            return
+        grown = np.empty((max(capacity * 2, appended + rows, 16), dim), dtype=self.dtype)
+        grown[:appended] = self._vectors[:appended]
+        self._vectors = grown
+        capacity = base_rows + len(grown)
+        if len(self._deleted) < capacity:
+            self._deleted = np.concatenate((self._deleted, np.zeros(capacity - len(self._deleted), dtype=bool)))
+            self._hidden = np.concatenate((self._hidden, np.zeros(capacity - len(self._hidden), dtype=bool)))
+
+    def _hidden_rows(self) -> Optional[np.ndarray]:
+        """
+        :return: mask of the rows that must not show up in search results, None if there are no such rows
+        """
+        if self._dead == 0 and self.exclude is None:
+            return None
+        if not self._hidden_valid:
+            hidden = self._deleted[:self._size].copy()
+            if self.exclude is not None:
+                hidden |= np.fromiter((self.exclude(obj) for obj in self.objects), dtype=bool, count=self._size)
+            self._hidden[:self._size] = hidden
+            self._hidden_valid = True
+        return self._hidden[:self._size]
+
+    def reindex(self, row: int):
+        """Refreshes the key and exclude state of a row after its object was modified in place"""
+        if self._hidden_valid and self.exclude is not None:
+            self._hidden[row] = self._deleted[row] or self.exclude(self.objects[row])
+        self._rows_by_key = None
+
+    def add(self, vector, obj):
+        self.add_batch(np.atleast_2d(vector), [obj])
+
+    def add_batch(self, vectors, objects: list):
+        self._append(vectors, objects, [uuid.uuid4().hex for _ in objects])
+
+    def _append(self, vectors, objects: list, ids: list[str]):
+        vectors = np.atleast_2d(vectors)
+        if len(vectors) != len(objects):
+            raise ValueError(f"got {len(vectors)} vectors for {len(objects)} objects")
+        if len(objects) == 0:
+            return
+        self._reserve(len(vectors), vectors.shape[1])
+        start = self._size - self._base_rows()
+        self._vectors[start:start + len(vectors)] = vectors
+        if self.key is not None and self._rows_by_key is not None:
+            for i, obj in enumerate(objects, start=self._size):
+                self._rows_by_key.setdefault(self.key(obj), i)
+        if self._hidden_valid:
+            self._hidden[self._size:self._size + len(objects)] = [
+                self.exclude is not None and self.exclude(obj) for obj in objects
+            ]
+        if self._rows_by_id is not None:
+            self._rows_by_id.update((row_id, i) for i, row_id in enumerate(ids, start=self._size))
+        self._ids.extend(ids)
+        self._size += len(vectors)
+        if self._objects_raw is not None:
+            self._raw_tail.extend(objects)
+        else:
+            self._objects.extend(objects)
+
+    def update_or_add(self, vector, obj, equals: callable=None):
+        if equals is None and self.key is not None:
+            row = self.find(self.key(obj))
+            if row is None:
+                self.add(vector, obj)
+                return self._size - 1
+            self._set_vector(row, vector)
+            return row
+        if equals is None:
+            equals = lambda a, b: a == b
+        for i, o in enumerate(self.objects):
+            if equals(o, obj):
+                self._set_vector(i, vector)
+                return i
+        self.add(vector, obj)
+        return self._size - 1
+
+    def _set_vector(self, row: int, vector):
+        base_rows = self._base_rows()
+        if row < base_rows:
+            self._base[row] = vector
+        else:
+            self._vectors[row - base_rows] = vector
+        if self._codes is not None and row < len(self._codes):
+            self._codes[row], self._scales[row] = (a[0] for a in quantize(vector))
+        if self._ann is not None and row < len(self._ann.assignments):
+            self._ann.assignments[row] = self._ann.assign(np.atleast_2d(vector))[0]
+
+    def _ann_candidates(self, vector, k: int) -> Optional[np.ndarray]:
+        """
+        :return: the rows to score for the vector, None when the whole db has to be scored
+        """
+        if self._ann is None or self._size < ANN_MIN_ROWS:
+            return None
+        assigned = len(self._ann.assignments)
+        if assigned < self._size:
+            self._ann.extend(self._rows_from(assigned))
+        rows = self._ann.candidates(vector)
+        if len(rows) < k:
+            return None
+        return rows
+
+    def _quantized_codes(self) -> tuple[np.ndarray, np.ndarray]:
+        if self._codes is None:
+            self._codes, self._scales = quantize(self._rows_from(0))
+        elif len(self._codes) < self._size:
+            codes, scales = quantize(self._rows_from(len(self._codes)))
+            self._codes = np.concatenate((self._codes, codes))
+            self._scales = np.concatenate((self._scales, scales))
+        return self._codes, self._scales
+
+    def _shortlist(self, vector, k: int, rows: Optional[np.ndarray]) -> np.ndarray:
+        """
+        :return: the rows (out of the given ones, or all) with the best approximate scores from the int8 codes
+        """
+        codes, scales = self._quantized_codes()
+        if rows is None:
+            scores = approximate_scores(codes[:self._size], scales[:self._size], vector)
+        else:
+            scores = approximate_scores(codes[rows], scales[rows], vector)
+        hidden = self._hidden_rows()
+        if hidden is not None:
+            scores[hidden if rows is None else hidden[rows]] = -np.inf
+        shortlist = top_k(scores, max(RERANK_MIN, k * RERANK_FACTOR))
+        return shortlist if rows is None else rows[shortlist]
+
+    def _ranked(self, vector, k: int, min_similarity: float, rows: np.ndarray = None) -> list[tuple[int, float]]:
+        vector = np.asarray(vector, dtype=self.dtype)
+        if rows is None:
+            rows = self._ann_candidates(vector, k)
+        if self.quantized:
+            rows = self._shortlist(vector, k, rows)
+        if rows is None:
+            scores = self._scores(vector)
+            return [(i, scores[i]) for i in top_k(scores, k) if scores[i] > min_similarity]
+        # exact scores for the candidates
+        scores = np.dot(self.vectors_at(rows), vector.flatten())
+        hidden = self._hidden_rows()
+        if hidden is not None:
+            scores[hidden[rows]] = -np.inf
+        return [(rows[i], scores[i]) for i in top_k(scores, k) if scores[i] > min_similarity]
+
+    def _scores(self, vector) -> np.ndarray:
+        # compute cosine similarity
+        scores = np.concatenate([np.dot(vector, segment.T).flatten() for segment in self._segments()])
+        hidden = self._hidden_rows()
+        if hidden is not None:
+            scores[hidden] = -np.inf
+        return scores
+
+    def search(self, vector, k=1, min_similarity=0.8, rows: np.ndarray = None):
+        """
+        :param rows: optional sorted array of rows to restrict the search to, e.g. the rows of some documents
+        """
+        if self._size == 0:
+            return []
+        return [(self.objects[i], score) for i, score in self._ranked(vector, k, min_similarity, rows)]
+
+    def argsearch(self, vector, k=1, min_similarity=0.8, rows: np.ndarray = None):
+        if self._size == 0:
+            return []
+        return self._ranked(vector, k, min_similarity, rows)
+
+    def search_many(self, queries, k=1, min_similarity=0.8) -> list[list[tuple]]:
+        """
+        Searches several query vectors at once, scoring them all with a single (exact) matrix product.
+        :return: a list of results per query, in the same format as search
+        """
+        queries = np.atleast_2d(queries)
+        if self._size == 0:
+            return [[] for _ in queries]
+        scores = np.hstack([np.dot(queries, segment.T) for segment in self._segments()])
+        hidden = self._hidden_rows()
+        if hidden is not None:
+            scores[:, hidden] = -np.inf
+        return [
+            [(self.objects[i], row[i]) for i in top_k(row, k) if row[i] > min_similarity]
+            for row in scores
+        ]
+
+    def index(self, obj):
+        return self.objects.index(obj)
+
+    def remove(self, index):
+        """
+        Removes a row in O(1) by tombstoning it. The row keeps its position, and rows don't shift until the
+        next compact(), which commit() runs once enough rows are dead and save() always runs.
+        """
+        if index < 0:
+            index += self._size
+        if self._deleted[index]:
+            return
+        self._tombstone(index)
+        if index < self._persisted_rows:
+            self._pending_deletes.append(index)
+
+    def is_removed(self, index) -> bool:
+        return bool(self._deleted[index])
+
+    def _tombstone(self, index):
+        self._deleted[index] = True
+        self._hidden[index] = True
+        self._dead += 1
+        if self._rows_by_key is not None and self._rows_by_key.get(self.key(self.objects[index])) == index:
+            # a duplicate key further down would take over, so just rebuild
+            self._rows_by_key = None
+
+    def compact(self):
+        """Drops the removed rows, the remaining rows shift to fill the gaps"""
+        if self._dead == 0:
+            return
+        live = ~self._deleted[:self._size]
+        objects = [obj for obj, keep in zip(self.objects, live) if keep]
+        ids = [self._row_id(i) for i in np.flatnonzero(live)]
+        ann = self._ann
+        self.vectors = self.vectors[live]
+        self.objects = objects
+        self._file_id_rows = 0
+        self._ids = ids
+        if ann is not None:
+            ann.keep(live[:len(ann.assignments)])
+            self._ann = ann
+        self._pending_deletes = []
+        # the persisted rows and pending deletes are tracked by position, which just changed
+        self._journal_in_sync = False
+
+    def save(self, path):
+        """
+        Writes the db in the current format: ``path`` holds a small json header that points to a raw vectors
+        matrix (.npy) and a json sidecar with the objects. Every save writes a new generation of the data files
+        and swaps the header last, so readers never see a half-written db.
+        """
+        self.compact()
+        dir_name = os.path.dirname(path)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        previous = _read_header(path)
+        base_name = os.path.basename(path)
+        generation = uuid.uuid4().hex[:8]
+        header = {
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "rows": self._size,
+            "dim": self.vectors.shape[1] if self.vectors.ndim == 2 else 0,
+            "vectors": f"{base_name}.{generation}.npy",
+            "objects": f"{base_name}.{generation}.json",
+            "ids": f"{base_name}.{generation}.ids.npy",
+        }
+        np.save(os.path.join(dir_name, header["vectors"]), np.ascontiguousarray(self.vectors))
+        ids = np.array([self._row_id(i) for i in range(self._size)], dtype=str)
+        np.save(os.path.join(dir_name, header["ids"]), ids)
+        if self.quantized:
+            codes, scales = self._quantized_codes()
+            header["codes"] = f"{base_name}.{generation}.i8.npy"
+            header["scales"] = f"{base_name}.{generation}.scales.npy"
+            np.save(os.path.join(dir_name, header["codes"]), codes[:self._size])
+            np.save(os.path.join(dir_name, header["scales"]), scales[:self._size])
+        with open(os.path.join(dir_name, header["objects"]), "w") as f:
+            json.dump(self.objects, f)
+        # make sure we don't corrupt the file
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(header, f)
+        os.replace(tmp_path, path)
+        if previous is not None:
+            _remove_data_files(dir_name, previous)
+        for suffix in (JOURNAL_SUFFIX, JOURNAL_VECTORS_SUFFIX):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        self._generation = header["vectors"]
+        self._reset_journal()
+        self._save_ann(path)
+
+    def _save_ann(self, path):
+        """
+        Keeps the approximate index next to the db file in sync. Rows added since it was trained are assigned
+        to the existing partitions, it gets retrained once the db doubled in size.
+        """
+        ann_path = path + ANN_SUFFIX
+        if self._size < ANN_MIN_ROWS:
+            self._ann = None
+            if os.path.exists(ann_path):
+                os.remove(ann_path)
+            return
+        if self._ann is None or self._size > 2 * self._ann.trained_rows:
+            logging.debug(f"training approximate index for {path}: {self._size} rows")
+            self._ann = IVFIndex.train(self.vectors)
+        elif len(self._ann.assignments) < self._size:
+            self._ann.extend(self.vectors[len(self._ann.assignments):])
+        self._ann.save(ann_path)
+
+    def _reset_journal(self):
+        self._persisted_rows = self._size
+        self._pending_deletes = []
+        self._journal_records = 0
+        self._journal_offset = 0
+        self._journal_in_sync = True
+
+    def commit(self, path, updated_rows: Iterable[int] = ()):
+        """
+        Persists the rows added since the last load/save/commit plus the given updated rows by appending them
+        to the journal next to the db file, so the cost does not depend on the size of the db. The vectors are
+        appended as raw rows to a sidecar of the journal, the journal itself only holds small json records. The
+        journal is replayed by load() and compacted into the db file once it grows past a fraction of the db.
+        """
+        if not os.path.exists(path) or not self._journal_in_sync:
+            self.save(path)
+            return
+        # rows added and removed again since the last commit never reach the journal
+        new_rows = [i for i in range(self._persisted_rows, self._size) if not self._deleted[i]]
+        updated = [i for i in sorted(set(updated_rows)) if i < self._persisted_rows and not self._deleted[i]]
+        vectors = np.ascontiguousarray(self.vectors_at(updated + new_rows))
+        records = [{"op": "update", "id": self._row_id(i), "object": self._object(i)} for i in updated]
+        records.extend({"op": "add", "id": self._row_id(i), "object": self._object(i)} for i in new_rows)
+        deletes = [{"op": "delete", "id": self._row_id(i)} for i in self._pending_deletes]
+        self._pending_deletes = []
+        if self._changed_on_disk(path):
+            # other processes committed or compacted since we last looked: take their state and put ours on top,
+            # so the rows end up in the order a fresh load replays them
+            self.load(path)
+            for record, vector in zip(records, vectors):
+                self._apply_record(record, vector)
+            for record in deletes:
+                self._apply_record(record)
+        journal_bytes = 0
+        if len(vectors):
+            at = _append_to_file(path + JOURNAL_VECTORS_SUFFIX, vectors.tobytes())
+            journal_bytes = at + vectors.nbytes
+            row_bytes = vectors.shape[1] * vectors.dtype.itemsize
+            for i, record in enumerate(records):
+                record.update(at=at + i * row_bytes, dim=vectors.shape[1], dtype=vectors.dtype.str)
+        records.extend(deletes)
+        data = b"".join((json.dumps(record) + "\n").encode("utf-8") for record in records)
+        at = _append_to_file(path + JOURNAL_SUFFIX, data)
+        # when another process appended in between, the journal is read again from before its records
+        if at == self._journal_offset:
+            self._journal_offset = at + len(data)
+        self._journal_records += len(records)
+        self._persisted_rows = self._size
+        if (self._journal_records > max(JOURNAL_COMPACT_MIN_RECORDS, self._size // 4)
+                or journal_bytes > JOURNAL_COMPACT_MAX_BYTES
+                or self._dead > self._size * COMPACT_DEAD_FRACTION):
+            logging.debug(f"compacting {path}: {self._journal_records} journal records ({journal_bytes} bytes of "
+                          f"vectors), {self._dead} dead rows")
+            if self._changed_on_disk(path):
+                self.load(path)
+            self.save(path)
+
+    def _changed_on_disk(self, path) -> bool:
+        """
+        :return: whether the db file was rewritten or the journal grew since this db last read or wrote them
+        """
+        header = _read_header(path)
+        if header is None or header["vectors"] != self._generation:
+            return True
+        try:
+            return os.path.getsize(path + JOURNAL_SUFFIX) != self._journal_offset
+        except OSError:
+            return self._journal_offset != 0
+
+    def _apply_record(self, record: dict, vector: np.ndarray = None):
+        op = record["op"]
+        row_id = record.get("id")
+        if row_id is None:
+            # written before the records had ids, its row is only meaningful if no other process committed
+            if op == "add":
+                row_id = uuid.uuid4().hex
+            elif record["row"] < self._size:
+                row_id = self._row_id(record["row"])
+            else:
+                return
+        if op == "add":
+            self._append(vector, [record["object"]], [row_id])
+            return
+        row = self._id_index().get(row_id)
+        if row is None or self._deleted[row]:
+            # removed by another process
+            return
+        if op == "delete":
+            self._tombstone(row)
+        elif op == "update":
+            self._set_vector(row, vector)
+            self._set_object(row, record["object"])
+
+    def _replay_journal(self, path):
+        journal_path = path + JOURNAL_SUFFIX
+        if not os.path.exists(journal_path):
+            return
+        with open(journal_path, "rb") as f:
+            f.seek(self._journal_offset)
+            data = f.read()
+        journal_vectors = _map_journal_vectors(path + JOURNAL_VECTORS_SUFFIX)
+        # consecutive adds are appended together
+        adds: list[tuple[np.ndarray, object, str]] = []
+        # a torn write from a crashed process leaves an incomplete last line, which is skipped
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode("utf-8", errors="replace").splitlines():
+            try:
+                record = json.loads(line)
+                vector = None if record["op"] == "delete" else _record_vector(record, journal_vectors)
+            except (ValueError, KeyError) as e:
+                logging.debug(f"skipping corrupt journal record in {journal_path}: {e}")
+                continue
+            if record["op"] == "add" and "id" in record:
+                adds.append((vector, record["object"], record["id"]))
+            else:
+                self._append_replayed(adds)
+                adds = []
+                self._apply_record(record, vector)
+            self._journal_records += 1
+        self._append_replayed(adds)
+        self._journal_offset += end
+        self._persisted_rows = self._size
+
+    def _append_replayed(self, adds: list[tuple[np.ndarray, object, str]]):
+        if adds:
+            vectors, objects, ids = zip(*adds)
+            self._append(np.stack(vectors), list(objects), list(ids))
+
+    def load(self, path):
+        header = _read_header(path)
+        if header is None:
+            # legacy .npz with a pickled object array, rewritten in the current format on the next save
+            data = np.load(path, allow_pickle=True)
+            self.vectors = data["vectors"]
+            self.objects = data["objects"].tolist()
+            self._generation = None
+            self._reset_journal()
+            self._journal_in_sync = False
+            return
+        dir_name = os.path.dirname(path)
+        # copy-on-write mapping: pages are read lazily and in-place updates never touch the file
+        self.vectors = np.load(os.path.join(dir_name, header["vectors"]), mmap_mode="c")
+        self._base = self._vectors
+        self._vectors = np.zeros((0, self._base.shape[1] if self._base.ndim == 2 else 0), dtype=self.dtype)
+        if self.quantized and "codes" in header:
+            self._codes = np.load(os.path.join(dir_name, header["codes"]), mmap_mode="c")
+            self._scales = np.load(os.path.join(dir_name, header["scales"]))
+        with open(os.path.join(dir_name, header["objects"]), "rb") as f:
+            self.objects = []
+            self._objects_raw = f.read()
+        self._raw_rows = self._size
+        self._rows_by_key = None
+        self._id_prefix = header["vectors"]
+        if "ids" in header:
+            self._file_ids = np.load(os.path.join(dir_name, header["ids"]), mmap_mode="r")
+        self._generation = header["vectors"]
+        self._ann = IVFIndex.load(path + ANN_SUFFIX)
+        if self._ann is not None and len(self._ann.assignments) > self._size:
+            logging.debug(f"ignoring approximate index of {path}, it doesn't match the db")
+            self._ann = None
+        self._reset_journal()
+        self._replay_journal(path)
+
+    def __len__(self):
+        return self._size - self._dead
+
+    def __getitem__(self, index):
+        return self.objects[index]
+
+    def __iter__(self):
+        if self._dead == 0:
+            return iter(self.objects)
+        return (obj for obj, deleted in zip(self.objects, self._deleted) if not deleted)
+
+    def __contains__(self, item):
+        if self.key is not None:
+            return self.key(item) in self._key_index()
+        return item in iter(self)
+
+    def __repr__(self):
+        return f"<VectorDB {len(self)} objects>"
+
+    def __str__(self):
+        return repr(self)
+
+
+FORMAT_NAME = "promptops-vectordb"
+FORMAT_VERSION = 2
+
+
+def _read_header(path) -> Optional[dict]:
+    """
+    :return: the header of a db in the current format, None if the file is missing or in the legacy .npz format
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        head = f.read(1)
+        if head != b"{":
+            return None
+        header = json.loads(head + f.read())
+    if header.get("format") != FORMAT_NAME:
+        return None
+    if header.get("version", 0) > FORMAT_VERSION:
+        raise ValueError(f"{path} was written by a newer version (format version {header['version']})")
+    return header
+
+
+def _remove_data_files(dir_name: str, header: dict):
+    for key in ("vectors", "objects", "ids", "codes", "scales"):
+        if key not in header:
+            continue
+        try:
+            os.remove(os.path.join(dir_name, header[key]))
+        except OSError as e:
+            logging.debug(f"failed to remove {header[key]}: {e}")
+
+
+JOURNAL_SUFFIX = ".journal"
+# raw rows of the vectors of the journal records
+JOURNAL_VECTORS_SUFFIX = ".journal.vectors"
+# the journal is compacted once it has more records than this, or than a quarter of the db
+JOURNAL_COMPACT_MIN_RECORDS = 256
+# or once its vectors take more than this, load() copies them to memory
+JOURNAL_COMPACT_MAX_BYTES = 32 * 1024 * 1024
+# fraction of removed rows that triggers a compaction on commit
+COMPACT_DEAD_FRACTION = 0.25
+ANN_SUFFIX = ".ivf"
+# quantized searches re-score max(RERANK_MIN, k * RERANK_FACTOR) rows exactly
+RERANK_FACTOR = 8
+RERANK_MIN = 32
+# below this many rows exact search is fast enough
+ANN_MIN_ROWS = 20_000
+
+
+def _append_to_file(path: str, data: bytes) -> int:
+    """
+    Appends with O_APPEND writes, so the data of concurrent writers never interleaves.
+    :return: the offset the data was written at
+    """
+    with open(path, "ab", buffering=0) as f:
+        written = 0
+        while written < len(data):
+            written += f.write(data[written:])
+        return f.tell() - len(data)
+
+
+def _map_journal_vectors(path: str) -> Optional[np.ndarray]:
+    """
+    :return: the bytes of the journal vectors sidecar, memory-mapped, None if there is none
+    """
+    try:
+        if os.path.getsize(path) == 0:
+            return None
+        # a plain ndarray view, slicing a memmap is several times slower
+        return np.memmap(path, dtype=np.uint8, mode="r").view(np.ndarray)
+    except OSError:
+        return None
+
+
+def _record_vector(record: dict, journal_vectors: Optional[np.ndarray]) -> np.ndarray:
+    if "vector" in record:
+        # written before the vectors moved to the sidecar
+        return np.frombuffer(base64.b64decode(record["vector"]), dtype=record["dtype"])
+    dtype = np.dtype(record["dtype"])
+    start = record["at"]
+    end = start + record["dim"] * dtype.itemsize
+    if journal_vectors is None or end > len(journal_vectors):
+        raise ValueError(f"vector of {record['id']} is missing from the journal vectors")
+    return journal_vectors[start:end].view(dtype)
+
+
+def remove_db(path):
+    """Removes a db saved with VectorDB.save together with its data files"""
+    header = _read_header(path)
+    os.remove(path)
+    for suffix in (JOURNAL_SUFFIX, JOURNAL_VECTORS_SUFFIX, ANN_SUFFIX):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    if header is not None:
+        _remove_data_files(os.path.dirname(path), header)
+
+
+def fetch_embeddings(texts: list[str], retry_status: bool = True) -> list[tuple[str, np.ndarray]]:
+    """
+    Requests the embeddings of several texts in one batch call.
+    :param retry_status: let the client send the batch again when the backend is overloaded, off when the caller
+        backs off itself like pipeline.embed_concurrently
+    :return: (text, embedding) for every text the backend returned an embedding for
+    """
+    resp = client.post(
+        "/embeddings",
+        json={
+            "batch": texts,
+            "trace_id": trace.trace_id,
+        },
+        retry_status=retry_status,
+    )
+    try:
+        resp.raise_for_status()
+    except Exception as e:
+        logging.debug(f"error getting embeddings: {e}, {resp.text}")
+        raise
+    # best effort for now
+    result = resp.json().get("result", [])
+    return [(item["text"], np.array(item["embeddings"], dtype=np.float32)) for item in result]
+
+
+_dispatcher: Optional[EmbeddingDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> EmbeddingDispatcher:
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = EmbeddingDispatcher(fetch_embeddings)
+    return _dispatcher
+
+
+@lru_cache(maxsize=1_000)
+def embedding(text: str) -> np.ndarray:
+    cache = get_cache()
+    key = cache_key("embeddings", text)
+    if cache is not None and (cached := cache.get(key)) is not None:
+        return cached[0]
+    # concurrent callers asking for the same text share a single request
+    vector = get_dispatcher().get(text)
+    if cache is not None:
+        cache.put(key, vector)
+    return vector
+
+
+def embedding_batch(
+    texts: list[str],
+    fetch: Callable[[list[str]], list[tuple[str, np.ndarray]]] = None,
+) -> list[tuple[str, np.ndarray]]:
+    """
+    Embeddings of several texts, from the disk cache where possible.
+    :param fetch: requests the texts that are not cached, by default through the dispatcher
+    :return: (text, embedding) for every text the backend returned an embedding for
+    """
+    cache = get_cache()
+    items = []
+    if cache is not None:
+        keys = {text: cache_key("embeddings", text) for text in texts}
+        cached = cache.get_many(keys.values())
+        items = [(text, cached[key][0]) for text, key in keys.items() if key in cached]
+        texts = [text for text, key in keys.items() if key not in cached]
+        if not texts:
+            return items
+    if fetch is not None:
+        fetched = fetch(texts)
+    else:
+        # shares requests with any concurrent embedding() calls for the same text
+        fetched = get_dispatcher().get_many(texts)
+    if cache is not None:
+        cache.put_many([(cache_key("embeddings", text), vector, None) for text, vector in fetched])
+
+    return items + fetched
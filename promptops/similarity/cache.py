@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Union, Iterable
+
+import numpy as np
+
+from promptops import settings
+from promptops.sqlite_file import SqliteFile
+
+# bump when the embeddings returned by the backend change, so stale vectors are never served
+MODEL_VERSION = "1"
+
+
+def cache_key(*parts: Union[str, bytes]) -> str:
+    """
+    Content hash of the parts, scoped to the model version and the backend that computes the embeddings.
+    """
+    h = hashlib.sha256()
+    for part in (MODEL_VERSION, settings.endpoint, *parts):
+        data = part.encode("utf-8") if isinstance(part, str) else part
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.hexdigest()
+
+
+class EmbeddingCache(object):
+    """
+    Size-bounded LRU cache of embeddings on disk. Entries are an array (a single vector or a matrix) plus
+    optional json metadata. Backed by sqlite in WAL mode, so several processes can use it at the same time.
+    The cache is best effort: any storage error is logged and treated as a miss.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._file = SqliteFile(path, self._setup, timeout=5)
+
+    @staticmethod
+    def _setup(conn: sqlite3.Connection):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " dtype TEXT NOT NULL,"
+            " shape TEXT NOT NULL,"
+            " data BLOB NOT NULL,"
+            " meta TEXT,"
+            " size INTEGER NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+    def _connection(self) -> sqlite3.Connection:
+        return self._file.connection()
+
+    def get(self, key: str) -> Optional[tuple[np.ndarray, object]]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, tuple[np.ndarray, object]]:
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        result = {}
+        try:
+            conn = self._connection()
+            # stay well below sqlite's limit on the number of query parameters
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, dtype, shape, data, meta FROM entries WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, dtype, shape, data, meta in rows:
+                    array = np.frombuffer(data, dtype=dtype).reshape(json.loads(shape))
+                    result[key] = (array, json.loads(meta) if meta is not None else None)
+            if result:
+                with conn:
+                    conn.executemany(
+                        "UPDATE entries SET last_used = ? WHERE key = ?", [(time.time(), key) for key in result]
+                    )
+        except sqlite3.Error as e:
+            logging.debug(f"embedding cache lookup failed: {e}")
+        return result
+
+    def put(self, key: str, array: np.ndarray, meta: object = None):
+        self.put_many([(key, array, meta)])
+
+    def put_many(self, entries: Iterable[tuple[str, np.ndarray, object]]):
+        now = time.time()
+        rows = []
+        for key, array, meta in entries:
+            array = np.ascontiguousarray(array)
+            data = array.tobytes()
+            meta = json.dumps(meta) if meta is not None else None
+            rows.append((key, array.dtype.str, json.dumps(array.shape), data, meta, len(data) + len(meta or ""), now))
+        if not rows:
+            return
+        try:
+            conn = self._connection()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._evict(conn)
+        except sqlite3.Error as e:
+            logging.debug(f"embedding cache update failed: {e}")
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # evict the least recently used entries down to 90% of the budget, so we don't evict on every put
+        excess = total - int(self.max_bytes * 0.9)
+        evicted = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+        with conn:
+            conn.executemany("DELETE FROM entries WHERE key = ?", evicted)
+        logging.debug(f"evicted {len(evicted)} entries from the embedding cache")
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[EmbeddingCache]:
+    """
+    :return: the shared embedding cache, None if it is disabled
+    """
+    global _cache
+    if not settings.embeddings_cache_size:
+        return None
+    with _cache_lock:
+        path = os.path.expanduser(settings.embeddings_cache_path)
+        if _cache is None or _cache.path != path:
+            _cache = EmbeddingCache(path, settings.embeddings_cache_size)
+    return _cache
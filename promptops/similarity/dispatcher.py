@@ -0,0 +1,113 @@
+import threading
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+import numpy as np
+
+
+class MissingEmbedding(KeyError):
+    """The backend answered the batch, but without an embedding for this text"""
+
+
+class EmbeddingDispatcher(object):
+    """
+    Funnels concurrent embedding requests into batch calls. Requests for a text that is already queued or in
+    flight share the same future, and requests arriving within `window` seconds of each other are sent together.
+    """
+
+    def __init__(
+        self,
+        fetch_batch: Callable[[list[str]], list[tuple[str, np.ndarray]]],
+        window: float = 0.005,
+        max_batch: int = 64,
+    ):
+        self._fetch_batch = fetch_batch
+        self._window = window
+        self._max_batch = max_batch
+        self._lock = threading.Lock()
+        self._queued: dict[str, Future] = {}
+        self._in_flight: dict[str, Future] = {}
+        self._timer: Optional[threading.Timer] = None
+
+    def submit(self, text: str) -> Future:
+        with self._lock:
+            future = self._queued.get(text) or self._in_flight.get(text)
+            if future is not None:
+                return future
+            future = Future()
+            self._queued[text] = future
+            if len(self._queued) >= self._max_batch:
+                self._cancel_timer()
+                batch = self._take_queued()
+            else:
+                if self._timer is None:
+                    self._timer = threading.Timer(self._window, self._flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return future
+        # a full batch is sent right away from the submitting thread
+        self._send(batch)
+        return future
+
+    def get(self, text: str, timeout: float = None) -> np.ndarray:
+        return self.submit(text).result(timeout)
+
+    def get_many(self, texts: list[str], timeout: float = None) -> list[tuple[str, np.ndarray]]:
+        """
+        :return: (text, embedding) for every text the backend returned an embedding for
+        """
+        futures = [(text, self.submit(text)) for text in dict.fromkeys(texts)]
+        items = []
+        for text, future in futures:
+            try:
+                items.append((text, future.result(timeout)))
+            except MissingEmbedding:
+                continue
+        return items
+
+    def flush(self):
+        """Sends the queued requests right away instead of at the end of the window"""
+        with self._lock:
+            self._cancel_timer()
+            batch = self._take_queued()
+        if batch:
+            self._send(batch)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _take_queued(self) -> dict[str, Future]:
+        batch = self._queued
+        self._queued = {}
+        self._in_flight.update(batch)
+        return batch
+
+    def _flush(self):
+        with self._lock:
+            self._timer = None
+            batch = self._take_queued()
+        if batch:
+            self._send(batch)
+
+    def _send(self, batch: dict[str, Future]):
+        error = None
+        try:
+            results = dict(self._fetch_batch(list(batch)))
+        except BaseException as e:
+            results = None
+            error = e
+        with self._lock:
+            for text in batch:
+                self._in_flight.pop(text, None)
+        for text, future in batch.items():
+            if results is None:
+                future.set_exception(error)
+            elif text in results:
+                future.set_result(results[text])
+            else:
+                future.set_exception(MissingEmbedding(text))
+        if error is not None and not isinstance(error, Exception):
+            # don't swallow KeyboardInterrupt and friends in the submitting thread
+            raise error
@@ -0,0 +1,117 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+# rows are assigned to their closest centroid in blocks of this size to bound the memory of the score matrix
+_ASSIGN_BLOCK = 8192
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return x / norms
+
+
+def _closest(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    :return: the index of the closest centroid of every row
+    """
+    assignments = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), _ASSIGN_BLOCK):
+        block = np.asarray(x[start:start + _ASSIGN_BLOCK], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def kmeans(x: np.ndarray, n_lists: int, iterations: int = 8, seed: int = 0) -> np.ndarray:
+    """
+    Spherical k-means: clusters unit vectors by cosine similarity.
+    :return: n_lists unit-length centroids
+    """
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float32)
+    centroids = x[rng.choice(len(x), n_lists, replace=False)]
+    for _ in range(iterations):
+        assignments = _closest(x, centroids)
+        # the members of every cluster are summed as contiguous runs of the rows sorted by cluster
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_lists)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        empty = counts == 0
+        sums = np.empty((n_lists, x.shape[1]), dtype=np.float32)
+        sums[~empty] = np.add.reduceat(x[order], starts[~empty], axis=0)
+        if empty.any():
+            # restart empty clusters from random points
+            sums[empty] = x[rng.choice(len(x), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IVFIndex(object):
+    """
+    Inverted file index for approximate nearest neighbour search. The rows are partitioned by their closest
+    k-means centroid and a query only scores the rows in its n_probe closest partitions.
+    """
+
+    def __init__(self, centroids: np.ndarray, trained_rows: int):
+        self.centroids = centroids
+        self.trained_rows = trained_rows
+        self.assignments = np.zeros(0, dtype=np.int32)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @staticmethod
+    def train(vectors: np.ndarray, seed: int = 0) -> "IVFIndex":
+        n_lists = min(4096, max(16, int(np.sqrt(len(vectors)))))
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(vectors), n_lists * 32)
+        sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+        index = IVFIndex(kmeans(sample, n_lists, seed=seed), len(vectors))
+        index.extend(vectors)
+        return index
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        return _closest(vectors, self.centroids)
+
+    def extend(self, vectors: np.ndarray):
+        """Assigns rows appended after the already assigned ones"""
+        self.assignments = np.concatenate((self.assignments, self.assign(vectors)))
+
+    def keep(self, mask: np.ndarray):
+        """Drops the assignments of rows that were compacted away"""
+        self.assignments = self.assignments[mask]
+
+    def default_n_probe(self) -> int:
+        return max(8, self.n_lists // 16)
+
+    def candidates(self, vector: np.ndarray, n_probe: int = None) -> np.ndarray:
+        """
+        :return: the rows in the partitions closest to the vector, in ascending order
+        """
+        n_probe = min(self.n_lists, n_probe or self.default_n_probe())
+        closeness = self.centroids @ np.asarray(vector, dtype=np.float32).flatten()
+        probe = np.argpartition(closeness, -n_probe)[-n_probe:]
+        return np.flatnonzero(np.isin(self.assignments, probe))
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                assignments=self.assignments,
+                trained_rows=np.array(self.trained_rows),
+            )
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str) -> Optional["IVFIndex"]:
+        if not os.path.exists(path):
+            return None
+        data = np.load(path)
+        index = IVFIndex(data["centroids"], int(data["trained_rows"]))
+        index.assignments = data["assignments"]
+        return index
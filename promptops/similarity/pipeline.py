@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, Future
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional
+
+import numpy as np
+import requests
+
+# statuses that mean the backend is overloaded, the batch is sent again after a pause
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.5
+MAX_BACKOFF = 30.0
+
+
+class AdaptiveBatchSizer(object):
+    """
+    Sizes the embedding batches and the number of batches in flight. Batches are capped by count and by payload
+    bytes. The batch size grows while the backend answers well below the target latency and shrinks when it is
+    slower, and the concurrency is halved whenever the backend throttles and grows back one batch at a time.
+    """
+
+    def __init__(
+        self,
+        initial_size: int = 32,
+        min_size: int = 8,
+        max_size: int = 256,
+        max_bytes: int = 64 * 1024,
+        target_latency: float = 2.0,
+        max_concurrency: int = 4,
+    ):
+        self.size = initial_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.target_latency = target_latency
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self._lock = threading.Lock()
+
+    def take(self, texts: list[str], start: int) -> int:
+        """
+        :return: the end of the next batch of texts that begins at start, it has at least one text
+        """
+        end = start
+        payload = 0
+        limit = min(len(texts), start + self.size)
+        while end < limit:
+            payload += len(texts[end].encode("utf-8"))
+            if payload > self.max_bytes and end > start:
+                break
+            end += 1
+        return max(end, start + 1)
+
+    def record(self, batch_len: int, latency: float):
+        with self._lock:
+            if latency > self.target_latency:
+                self.size = max(self.min_size, self.size // 2)
+            elif latency < self.target_latency / 2 and batch_len >= self.size:
+                self.size = min(self.max_size, self.size * 2)
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+
+    def throttled(self):
+        with self._lock:
+            self.concurrency = max(1, self.concurrency // 2)
+            self.size = max(self.min_size, self.size // 2)
+
+
+def _retry_after(response: Optional[requests.Response], attempt: int) -> Optional[float]:
+    """
+    :return: how long to wait before sending the batch again, None if the error is not worth a retry
+    """
+    if response is None or response.status_code not in RETRY_STATUSES or attempt + 1 >= MAX_ATTEMPTS:
+        return None
+    try:
+        return min(MAX_BACKOFF, float(response.headers["retry-after"]))
+    except (KeyError, ValueError):
+        return min(MAX_BACKOFF, BACKOFF_BASE * 2 ** attempt)
+
+
+def embed_concurrently(
+    texts: Iterable[str],
+    fetch_batch: Callable[[list[str]], list[tuple[str, np.ndarray]]],
+    sizer: AdaptiveBatchSizer = None,
+) -> Iterator[tuple[list[str], list[tuple[str, np.ndarray]]]]:
+    """
+    Embeds the texts with several batches in flight, so a large number of texts is limited by the throughput of
+    the backend rather than by the round trips. The texts are consumed lazily, only the batches in flight are held
+    in memory.
+    :param fetch_batch: embeds a batch, e.g. embedding_batch. It raises requests.HTTPError for overloaded answers
+        without retrying them, the retries and backoff are done here
+    :return: (batch, (text, embedding) of the batch) as the batches complete, not necessarily in order
+    """
+    sizer = sizer or AdaptiveBatchSizer()
+
+    def fetch(batch: list[str]) -> list[tuple[str, np.ndarray]]:
+        for attempt in range(MAX_ATTEMPTS):
+            started = time.monotonic()
+            try:
+                items = fetch_batch(batch)
+            except requests.HTTPError as e:
+                delay = _retry_after(e.response, attempt)
+                if delay is None:
+                    raise
+                logging.debug(f"embeddings throttled ({e.response.status_code}), retrying in {delay:.1f}s")
+                sizer.throttled()
+                time.sleep(delay)
+                continue
+            sizer.record(len(batch), time.monotonic() - started)
+            return items
+
+    texts = iter(texts)
+    buffer: list[str] = []
+    exhausted = False
+    executor = ThreadPoolExecutor(max_workers=sizer.max_concurrency)
+    pending: dict[Future, list[str]] = {}
+    try:
+        while True:
+            while len(pending) < sizer.concurrency:
+                if not exhausted and len(buffer) < sizer.size:
+                    buffer.extend(islice(texts, sizer.size - len(buffer)))
+                    exhausted = len(buffer) < sizer.size
+                if not buffer:
+                    break
+                end = sizer.take(buffer, 0)
+                batch, buffer = buffer[:end], buffer[end:]
+                pending[executor.submit(fetch, batch)] = batch
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+    finally:
+        # don't wait for the batches in flight when interrupted
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,28 @@
+import numpy as np
+
+# codes are converted back to floats in blocks of this many rows to bound the temporary memory
+_SCORE_BLOCK = 8192
+
+
+def quantize(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric per-row scalar quantization to int8.
+    :return: the int8 codes and the per-row scales, vectors ~= codes * scales[:, None]
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def approximate_scores(codes: np.ndarray, scales: np.ndarray, vector: np.ndarray) -> np.ndarray:
+    """
+    :return: the dot products of the vector with the dequantized rows
+    """
+    vector = np.asarray(vector, dtype=np.float32).flatten()
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), _SCORE_BLOCK):
+        block = codes[start:start + _SCORE_BLOCK]
+        scores[start:start + len(block)] = block.astype(np.float32) @ vector
+    return scores * scales
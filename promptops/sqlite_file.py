@@ -0,0 +1,39 @@
+import os
+import sqlite3
+import threading
+from typing import Callable
+
+
+class SqliteFile(object):
+    """
+    A sqlite file in WAL mode, so several processes can read and write it at the same time. Every thread gets its
+    own connection, they are opened on first use, after creating the directory of the file.
+    """
+
+    def __init__(self, path: str, setup: Callable[[sqlite3.Connection], None], timeout: float = 10):
+        """
+        :param setup: prepares a new connection, e.g. creates the tables. When it raises, the connection is
+            closed and the error is passed on.
+        :param timeout: seconds to wait for the lock of another writer
+        """
+        self.path = path
+        self._setup = setup
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            dir_name = os.path.dirname(self.path)
+            if dir_name and not os.path.exists(dir_name):
+                os.makedirs(dir_name, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self._timeout)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                self._setup(conn)
+            except BaseException:
+                conn.close()
+                raise
+            self._local.conn = conn
+        return conn
@@ -10,7 +10,7 @@ from promptops.ui.prompts import confirm, EXIT, GO_BACK
 from promptops.ui import selections
 from prompt_toolkit import print_formatted_text
 from prompt_toolkit.formatted_text import HTML
-import requests
+from promptops import client
 from promptops.trace import trace_id
 from promptops import settings_store
 
@@ -99,10 +99,10 @@ def collect_config():
         config_selections["loaded_history"] = True
         if has_more:
             print()
-            all_history = get_shell().get_full_history()
+            history_size = sum(1 for _ in get_shell().iter_full_history())
             print_formatted_text(
                 HTML(
-                    f"  📖 we've indexed your last {initial_batch} commands, but there's {len(all_history) - initial_batch} more!"
+                    f"  📖 we've indexed your last {initial_batch} commands, but there's {history_size - initial_batch} more!"
                 )
             )
             print()
@@ -156,14 +156,13 @@ def register():
             email = ""
         print()
 
-        requests.post(
-            settings.endpoint + "/installed",
+        client.post(
+            "/installed",
             json={"trace_id": trace_id, "email": email, "platform": sys.platform, "python_version": sys.version},
-            headers={"user-agent": user_agent()},
         )
         config = config_flow()
         config["trace_id"] = trace_id
-        requests.post(settings.endpoint + "/config", json=config, headers={"user-agent": user_agent()})
+        client.post("/config", json=config)
         settings_store.save()
     except KeyboardInterrupt:
         pass
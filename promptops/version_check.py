@@ -1,9 +1,8 @@
 import os.path
 import time
 
-import requests
+from promptops import client
 from promptops import settings
-from promptops import user
 from promptops import version
 from prompt_toolkit import print_formatted_text
 from prompt_toolkit.formatted_text import HTML
@@ -48,13 +47,12 @@ def should_show_changes(r: Response):
 
 
 def version_check():
-    response = requests.post(
-        settings.endpoint + "/version",
+    response = client.post(
+        "/version",
         json={
             "version": version.__version__,
             "trace_id": trace_id,
         },
-        headers={"user-agent": f"promptops-cli; user_id={user.user_id()}"},
     )
     if response.status_code != 200:
         print("version check failed", response.status_code, response.text)
@@ -1,5 +1,6 @@
 import numpy as np
 from promptops.similarity import VectorDB
+import os
 import tempfile
 from time import time
 
@@ -20,13 +21,18 @@ def generate_data(samples: int, d: int, seed: int = 42) -> VectorDB:
 
 def main():
     db = generate_data(10000, 1536)
-    with tempfile.NamedTemporaryFile(suffix=".npz") as f:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "test.db")
         now = time()
-        db.save(f.name)
+        db.save(path)
         print(f"saved in {time() - now:.3f} seconds")
         now = time()
-        db.load(f.name)
+        db = VectorDB()
+        db.load(path)
         print(f"loaded in {time() - now:.3f} seconds")
+        now = time()
+        _ = db.objects
+        print(f"objects decoded in {time() - now:.3f} seconds")
 
     # test search
     query = np.random.randn(1, 1536)
@@ -36,6 +42,13 @@ def main():
     print(f"searched in {time() - now:.3f} seconds")
     print(results)
 
+    quantized = VectorDB(quantized=True)
+    quantized.add_batch(db.vectors, db.objects)
+    quantized.search(query, k=10, min_similarity=0.0)
+    now = time()
+    quantized_results = quantized.search(query, k=10, min_similarity=0.0)
+    print(f"quantized search in {time() - now:.3f} seconds, same results: {quantized_results == results}")
+
 
 if __name__ == "__main__":
     main()
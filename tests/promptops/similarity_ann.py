@@ -0,0 +1,50 @@
+"""
+Recall and latency of the approximate (IVF) search against the exact search.
+
+    python tests/promptops/similarity_ann.py [samples] [dimensions]
+"""
+import sys
+import numpy as np
+from promptops import similarity
+from promptops.similarity import VectorDB
+from time import time
+
+
+def generate_clustered_data(samples: int, d: int, clusters: int = 500, seed: int = 42) -> np.ndarray:
+    # real embeddings are far from uniform, so sample around a set of topics
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, d)).astype(np.float32)
+    x = centers[rng.integers(0, clusters, samples)] + 0.6 * rng.standard_normal((samples, d)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def main(samples: int = 50_000, d: int = 1536, queries: int = 200, k: int = 10):
+    x = generate_clustered_data(samples + queries, d)
+    x, q = x[:samples], x[samples:]
+
+    db = VectorDB()
+    db.add_batch(x, list(range(samples)))
+    exact = []
+    now = time()
+    for vector in q:
+        exact.append([i for i, _ in db.argsearch(vector, k=k, min_similarity=-1.0)])
+    exact_time = (time() - now) / queries
+
+    now = time()
+    db._ann = similarity.IVFIndex.train(db.vectors)
+    print(f"trained {db._ann.n_lists} partitions in {time() - now:.3f} seconds")
+
+    approximate = []
+    now = time()
+    for vector in q:
+        approximate.append([i for i, _ in db.argsearch(vector, k=k, min_similarity=-1.0)])
+    approximate_time = (time() - now) / queries
+
+    recall = np.mean([len(set(a) & set(e)) / k for a, e in zip(approximate, exact)])
+    print(f"exact search:       {exact_time * 1000:.2f} ms/query")
+    print(f"approximate search: {approximate_time * 1000:.2f} ms/query")
+    print(f"recall@{k}: {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
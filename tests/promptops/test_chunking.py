@@ -0,0 +1,33 @@
+from promptops.index.chunking import split_chunks, chunk_hash
+
+
+DOC = """# Title
+
+Intro paragraph.
+
+## Install
+
+Run the installer:
+
+    pip install promptops
+
+## Usage
+
+""" + "A long usage paragraph line.\n" * 100
+
+
+def test_split_chunks():
+    chunks = split_chunks(DOC, max_chars=500)
+    assert "".join(chunks) == DOC
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert chunks[0] == "# Title\n\nIntro paragraph.\n\n"
+    assert chunks[1].startswith("## Install")
+    assert chunks[2].startswith("## Usage")
+
+
+def test_edit_keeps_other_chunks():
+    chunks = split_chunks(DOC, max_chars=500)
+    edited = split_chunks(DOC.replace("Intro paragraph.", "Edited intro."), max_chars=500)
+    assert chunks[0] != edited[0]
+    assert chunks[1:] == edited[1:]
+    assert chunk_hash(chunks[1]) == chunk_hash(edited[1])
@@ -0,0 +1,74 @@
+import gzip
+import json
+
+import responses
+
+from promptops import client
+from promptops import settings
+
+
+@responses.activate
+def test_compresses_large_bodies(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "endpoint", "http://localhost:8080")
+    monkeypatch.setattr(settings, "user_id_path", str(tmp_path / "user_id"))
+    responses.post(settings.endpoint + "/query", json={"suggestions": []})
+
+    client.post("/query", json={"query": "list files"})
+    request = responses.calls[0].request
+    assert "content-encoding" not in request.headers
+    assert json.loads(request.body) == {"query": "list files"}
+    assert request.headers["user-agent"].startswith("promptops-cli; user_id=user-")
+
+    history = ["git status"] * 200
+    client.post("/query", json={"query": "list files", "history": history})
+    request = responses.calls[1].request
+    assert request.headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(request.body))["history"] == history
+
+
+@responses.activate
+def test_retries_unavailable_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "endpoint", "http://localhost:8080")
+    monkeypatch.setattr(settings, "user_id_path", str(tmp_path / "user_id"))
+    monkeypatch.setattr(client, "_sessions", {})
+    responses.post(settings.endpoint + "/feedback", status=503)
+    responses.post(settings.endpoint + "/feedback", json={})
+
+    response = client.post("/feedback", json={"rating": 1})
+    assert response.status_code == 200
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_retries_gateway_errors_of_cheap_requests_only(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "endpoint", "http://localhost:8080")
+    monkeypatch.setattr(settings, "user_id_path", str(tmp_path / "user_id"))
+    monkeypatch.setattr(client, "_sessions", {})
+    responses.post(settings.endpoint + "/query", status=502)
+    responses.post(settings.endpoint + "/embeddings", status=504)
+    responses.post(settings.endpoint + "/embeddings", json={"result": []})
+
+    # the backend may have started generating already
+    assert client.post("/query", json={"query": "list files"}).status_code == 502
+    assert len(responses.calls) == 1
+    assert client.post("/embeddings", json={"batch": ["ls"]}).status_code == 200
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_no_status_retries(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "endpoint", "http://localhost:8080")
+    monkeypatch.setattr(settings, "user_id_path", str(tmp_path / "user_id"))
+    monkeypatch.setattr(client, "_sessions", {})
+    responses.post(settings.endpoint + "/embeddings", status=429)
+
+    assert client.post("/embeddings", json={"batch": ["ls"]}, retry_status=False).status_code == 429
+    assert len(responses.calls) == 1
+
+
+def test_timeouts():
+    assert client._timeout("/index_data?trace_id=1") == (client.CONNECT_TIMEOUT, client.READ_TIMEOUTS["/index_data"])
+    assert client._timeout("/recipe/stream/init")[1] == client.READ_TIMEOUTS["/recipe/stream"]
+    assert client._timeout("/recipe/init")[1] == client.READ_TIMEOUTS["/recipe/init"]
+    assert client._timeout("/recipe/save")[1] < client.DEFAULT_READ_TIMEOUT
+    assert client._timeout("/unknown")[1] == client.DEFAULT_READ_TIMEOUT
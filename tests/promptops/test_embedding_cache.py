@@ -0,0 +1,67 @@
+import numpy as np
+import responses
+
+from promptops import settings
+from promptops.similarity.cache import EmbeddingCache, cache_key
+
+
+def test_get_put(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.cache"), 1024 * 1024)
+    vector = np.arange(8, dtype=np.float32)
+    cache.put(cache_key("embeddings", "ls -la"), vector)
+    matrix = np.ones((3, 4), dtype=np.float32)
+    cache.put(cache_key("index_data", "text/markdown", b"# readme"), matrix, [{"text": "a"}, {"text": "b"}, {"text": "c"}])
+
+    array, meta = cache.get(cache_key("embeddings", "ls -la"))
+    assert np.array_equal(array, vector)
+    assert meta is None
+    array, meta = cache.get(cache_key("index_data", "text/markdown", b"# readme"))
+    assert array.shape == (3, 4)
+    assert meta[1] == {"text": "b"}
+    assert cache.get(cache_key("embeddings", "ls")) is None
+
+    # another process sees the same entries
+    other = EmbeddingCache(str(tmp_path / "embeddings.cache"), 1024 * 1024)
+    assert cache_key("embeddings", "ls -la") in other.get_many([cache_key("embeddings", "ls -la")])
+
+
+def test_evicts_least_recently_used(tmp_path):
+    vector = np.zeros(256, dtype=np.float32)  # 1 KB
+    cache = EmbeddingCache(str(tmp_path / "embeddings.cache"), 10 * 1024)
+    for i in range(10):
+        cache.put(f"key {i}", vector)
+    # touch the oldest entry, so it survives the eviction
+    assert cache.get("key 0") is not None
+    cache.put("key 10", vector)
+    assert cache.get("key 0") is not None
+    assert cache.get("key 1") is None
+    assert cache.get("key 10") is not None
+
+
+@responses.activate
+def test_embedding_uses_cache(tmp_path, monkeypatch):
+    from promptops import similarity, history
+
+    monkeypatch.setattr(settings, "endpoint", "http://localhost:8080")
+    monkeypatch.setattr(settings, "embeddings_cache_path", str(tmp_path / "embeddings.cache"))
+    monkeypatch.setattr(settings, "user_id_path", str(tmp_path / "user_id"))
+    responses.post(
+        settings.endpoint + "/embeddings", json={"result": [{"text": "list files", "embeddings": [0.5] * 4}]}
+    )
+
+    similarity.embedding.cache_clear()
+    assert np.allclose(similarity.embedding("list files"), 0.5)
+    similarity.embedding.cache_clear()
+    assert np.allclose(similarity.embedding("list files"), 0.5)
+    assert len(responses.calls) == 1
+
+    # the batch form shares the cached vectors and only requests the misses
+    responses.replace(
+        responses.POST, settings.endpoint + "/embeddings", json={"result": [{"text": "ls", "embeddings": [1.0] * 4}]}
+    )
+    items = dict(history.embedding_batch(["list files", "ls"]))
+    assert np.allclose(items["list files"], 0.5)
+    assert np.allclose(items["ls"], 1.0)
+    assert len(responses.calls) == 2
+    assert b"list files" not in responses.calls[1].request.body
+    similarity.embedding.cache_clear()
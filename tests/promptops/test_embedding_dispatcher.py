@@ -0,0 +1,82 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from promptops.similarity.dispatcher import EmbeddingDispatcher, MissingEmbedding
+
+
+class FakeBackend:
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.batches = []
+
+    def fetch(self, texts):
+        self.batches.append(texts)
+        time.sleep(self.delay)
+        return [(text, np.full(4, len(text), dtype=np.float32)) for text in texts if text != "missing"]
+
+
+def test_coalesces_concurrent_requests():
+    backend = FakeBackend(delay=0)
+    # the window doesn't end during the test, the batch is sent by the explicit flush
+    dispatcher = EmbeddingDispatcher(backend.fetch, window=60)
+    texts = ["a", "bb", "a", "ccc", "bb"]
+    barrier = threading.Barrier(len(texts))
+    futures = {}
+
+    def request(i, text):
+        barrier.wait()
+        futures[i] = dispatcher.submit(text)
+
+    threads = [threading.Thread(target=request, args=(i, text)) for i, text in enumerate(texts)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.batches == []
+    dispatcher.flush()
+
+    assert len(backend.batches) == 1
+    assert sorted(backend.batches[0]) == ["a", "bb", "ccc"]
+    assert futures[0] is futures[2] and futures[1] is futures[4]
+    assert np.allclose(futures[3].result(timeout=1), 3)
+
+
+def test_single_flight():
+    backend = FakeBackend(delay=0.2)
+    dispatcher = EmbeddingDispatcher(backend.fetch, window=0.001)
+    first = dispatcher.submit("ls")
+    time.sleep(0.05)
+    # the first request is in flight by now, the second one just waits for it
+    second = dispatcher.submit("ls")
+    assert second is first
+    assert np.allclose(second.result(), 2)
+    assert backend.batches == [["ls"]]
+
+
+def test_full_batch_is_sent_right_away():
+    backend = FakeBackend(delay=0)
+    # the window is longer than the timeout, so this only passes if the full batch doesn't wait for it
+    dispatcher = EmbeddingDispatcher(backend.fetch, window=10, max_batch=3)
+    items = dispatcher.get_many(["a", "b", "missing"], timeout=1)
+    assert [text for text, _ in items] == ["a", "b"]
+    assert len(backend.batches) == 1
+
+
+def test_missing_embedding():
+    dispatcher = EmbeddingDispatcher(FakeBackend(delay=0).fetch, window=0.001)
+    with pytest.raises(MissingEmbedding):
+        dispatcher.get("missing", timeout=1)
+
+
+def test_errors_reach_every_caller():
+    def fetch(texts):
+        raise ConnectionError("offline")
+
+    dispatcher = EmbeddingDispatcher(fetch, window=0.01)
+    futures = [dispatcher.submit("a"), dispatcher.submit("b")]
+    for future in futures:
+        with pytest.raises(ConnectionError):
+            future.result()
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+import requests
+import responses
+
+from promptops import client, history, settings, similarity
+from promptops.similarity import pipeline
+from promptops.similarity.pipeline import AdaptiveBatchSizer, embed_concurrently
+
+
+def fake_fetch(texts):
+    return [(text, np.ones(4, dtype=np.float32)) for text in texts]
+
+
+def test_batches_are_capped_by_bytes():
+    sizer = AdaptiveBatchSizer(initial_size=10, max_bytes=10)
+    texts = ["aaaa", "bbbb", "cccc", "d" * 20, "e"]
+    assert sizer.take(texts, 0) == 2
+    # a text larger than the cap is sent on its own
+    assert sizer.take(texts, 3) == 4
+    assert sizer.take(texts, 4) == 5
+
+
+def test_keeps_several_batches_in_flight():
+    in_flight = []
+    peak = []
+    lock = threading.Lock()
+
+    def slow_fetch(texts):
+        with lock:
+            in_flight.append(texts)
+            peak.append(len(in_flight))
+        time.sleep(0.05)
+        with lock:
+            in_flight.remove(texts)
+        return fake_fetch(texts)
+
+    texts = [f"echo {i}" for i in range(100)]
+    sizer = AdaptiveBatchSizer(initial_size=10, max_concurrency=4)
+    batches = list(embed_concurrently(texts, slow_fetch, sizer))
+    assert sorted(text for _, items in batches for text, _ in items) == sorted(texts)
+    assert max(peak) > 1
+
+
+def test_backs_off_when_throttled(monkeypatch):
+    monkeypatch.setattr(pipeline, "BACKOFF_BASE", 0.001)
+    calls = []
+
+    def throttled_fetch(texts):
+        calls.append(texts)
+        if len(calls) == 1:
+            response = requests.Response()
+            response.status_code = 429
+            raise requests.HTTPError(response=response)
+        return fake_fetch(texts)
+
+    sizer = AdaptiveBatchSizer(initial_size=16, min_size=4, max_concurrency=4)
+    batches = list(embed_concurrently([f"echo {i}" for i in range(16)], throttled_fetch, sizer))
+    assert len(batches) == 1 and len(batches[0][1]) == 16
+    assert calls[0] == calls[1]
+    # fewer batches in flight after the throttling, growing back one at a time
+    assert sizer.concurrency == 3
+
+    def failing_fetch(texts):
+        response = requests.Response()
+        response.status_code = 400
+        raise requests.HTTPError(response=response)
+
+    with pytest.raises(requests.HTTPError):
+        list(embed_concurrently(["echo"], failing_fetch))
+
+
+@responses.activate
+def test_only_the_pipeline_retries_history_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "endpoint", "http://localhost:8080")
+    monkeypatch.setattr(settings, "user_id_path", str(tmp_path / "user_id"))
+    monkeypatch.setattr(client, "_sessions", {})
+    monkeypatch.setattr(similarity, "get_cache", lambda: None)
+    monkeypatch.setattr(pipeline, "BACKOFF_BASE", 0.001)
+    responses.post(settings.endpoint + "/embeddings", status=429)
+    responses.post(settings.endpoint + "/embeddings", json={"result": [{"text": "ls", "embeddings": [1.0, 0.0]}]})
+
+    sizer = AdaptiveBatchSizer(max_concurrency=4)
+    batches = list(embed_concurrently(["ls"], history._fetch_history_batch, sizer))
+    assert [text for text, _ in batches[0][1]] == ["ls"]
+    # the throttling reached the pipeline instead of being retried by the client
+    assert len(responses.calls) == 2
+    assert sizer.concurrency == 3
@@ -0,0 +1,129 @@
+import time
+
+import numpy as np
+import pytest
+
+from promptops import history, settings
+from promptops.shells.base import reset_extra_history
+from promptops.shells.bash import Bash
+from promptops.shells.zsh import Zsh
+
+
+@pytest.fixture
+def requested(tmp_path, monkeypatch):
+    requested = []
+
+    def fake_embedding_batch(texts, fetch=None):
+        requested.extend(texts)
+        return [(text, np.ones(8, dtype=np.float32) / np.sqrt(8)) for text in texts]
+
+    monkeypatch.setattr(history, "embedding_batch", fake_embedding_batch)
+    monkeypatch.setattr(history, "_hist_db", None)
+    reset_extra_history()
+    monkeypatch.setattr(settings, "history_db_path", str(tmp_path / "history.db"))
+    monkeypatch.setattr(settings, "history_checkpoints_path", str(tmp_path / "history_checkpoints.json"))
+    return requested
+
+
+def test_index_history_reads_appended_commands(tmp_path, monkeypatch, requested):
+    history_file = tmp_path / ".bash_history"
+    history_file.write_text("ls -la\ncd /tmp\n")
+    shell = Bash(str(history_file))
+    monkeypatch.setattr(history, "get_shell", lambda: shell)
+    offsets = []
+    get_history_since = shell.get_history_since
+
+    def spy(offset):
+        offsets.append(offset)
+        return get_history_since(offset)
+
+    monkeypatch.setattr(shell, "get_history_since", spy)
+
+    history.index_history(max_history=0)
+    assert requested == ["ls -la", "cd /tmp"]
+
+    # nothing was appended, the history file isn't read
+    history.index_history()
+    assert offsets == []
+
+    # only the appended commands are read, the continued one is left until its last line is written
+    with open(history_file, "a") as f:
+        f.write("git status\necho one \\\n")
+    history.index_history()
+    assert requested == ["ls -la", "cd /tmp", "git status"]
+    with open(history_file, "a") as f:
+        f.write("two\n")
+    history.index_history()
+    assert requested == ["ls -la", "cd /tmp", "git status", "echo one \\\ntwo"]
+    assert offsets == [len("ls -la\ncd /tmp\n"), len("ls -la\ncd /tmp\ngit status\n")]
+
+    # a rewritten history file is read again
+    history_file.write_text("make\nmake test\n")
+    history.index_history()
+    assert requested[-1] == "make test"
+    assert len(offsets) == 2
+
+    # also when it's rewritten in place and grows, like bash does without histappend
+    history_file.write_text("cargo build\ncargo test\n")
+    history.index_history()
+    assert requested[-1] == "cargo test"
+    assert len(offsets) == 2
+
+
+def test_zsh_history_since(tmp_path):
+    history_file = tmp_path / ".zsh_history"
+    # "ă" is c4 83, zsh writes the 0x83 byte metafied
+    history_file.write_bytes(b": 1:0;ls\n: 2:0;echo \xc4\x83\xa3\n: 3:0;for i in 1 2\\\ndo echo $i\\\n")
+    shell = Zsh(str(history_file))
+    commands, offset = shell.get_history_since(0)
+    assert commands == ["ls", "echo ă"]
+    with open(history_file, "ab") as f:
+        f.write(b"done\n")
+    commands, end = shell.get_history_since(offset)
+    assert commands == ["for i in 1 2\ndo echo $i\ndone"]
+    assert end == history_file.stat().st_size
+
+
+def test_index_history_resumes_after_interrupt(tmp_path, monkeypatch, requested):
+    history_file = tmp_path / ".bash_history"
+    history_file.write_text("".join(f"echo {i}\n" for i in range(100)))
+    monkeypatch.setattr(history, "get_shell", lambda: Bash(str(history_file)))
+    fake_embedding_batch = history.embedding_batch
+
+    def interrupted_embedding_batch(texts, fetch=None):
+        if "echo 70" in texts:
+            # the other batches in flight complete first
+            time.sleep(0.2)
+            raise KeyboardInterrupt()
+        return fake_embedding_batch(texts)
+
+    monkeypatch.setattr(history, "embedding_batch", interrupted_embedding_batch)
+    with pytest.raises(KeyboardInterrupt):
+        history.index_history(max_history=0)
+
+    # the batches completed before the interruption were committed
+    history._hist_db = None
+    committed = {obj["cmd"] for obj in history.get_history_db().objects}
+    assert committed and "echo 70" not in committed
+
+    # the next regular run continues the full indexing
+    monkeypatch.setattr(history, "embedding_batch", fake_embedding_batch)
+    with open(history_file, "a") as f:
+        f.write("echo done\n")
+    requested.clear()
+    history.index_history()
+    assert sorted(requested) == sorted([f"echo {i}" for i in range(100) if f"echo {i}" not in committed] + ["echo done"])
+    assert "resume" not in history._load_checkpoints()[str(history_file)]
+
+
+def test_full_history_is_streamed(tmp_path):
+    history_file = tmp_path / ".zsh_history"
+    history_file.write_text("".join(f": {i}:0;echo {i}\n" for i in range(5000)) + "\n\n")
+    shell = Zsh(str(history_file))
+    read = []
+    commands = shell.iter_full_history(read.append)
+    assert next(commands) == "echo 0"
+    # only the first window was read and scrubbed
+    assert 0 < sum(read) < history_file.stat().st_size
+    assert ["echo 0"] + list(commands) == [f"echo {i}" for i in range(5000)]
+    assert sum(read) == history_file.stat().st_size
@@ -0,0 +1,237 @@
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+from promptops.index import index_store
+from promptops.index.index_store import IndexStore, ItemMetadata, LoadedFragments, LoadedFragmentsCache
+from promptops.similarity import VectorDB
+
+
+def make_item(location: str) -> ItemMetadata:
+    now = datetime.now()
+    return ItemMetadata(
+        item_type="file", item_location=location, index_location="", added_on=now, last_indexed_on=now, watch=True
+    )
+
+
+def make_db(texts: list[str], axes: list[int]) -> VectorDB:
+    db = VectorDB()
+    db.add_batch(np.eye(8, dtype=np.float32)[axes], [{"text": text} for text in texts])
+    return db
+
+
+def test_search_all_items(tmp_path):
+    store = IndexStore(str(tmp_path))
+    store.add_or_update(make_item("/a/README.md"), make_db(["a0 ", "a1 ", "a2 "], [0, 1, 2]))
+    store.add_or_update(make_item("/b/README.md"), make_db(["b0 ", "b1 "], [3, 4]))
+
+    results = store.search(np.eye(8)[1], k=1)
+    assert [(r.item.item_location, r.fragment.fragment) for r in results] == [("/a/README.md", "a0 a1 a2 ")]
+    # the context never crosses into the fragments of another item
+    results = store.search(np.eye(8)[3], k=1)
+    assert results[0].fragment.fragment == "b0 b1 "
+
+    results = store.search(np.eye(8)[1], k=3, accept_source=lambda meta: meta.item_location.startswith("/b"))
+    assert results == []
+
+    # a fresh store sees the same fragments
+    results = IndexStore(str(tmp_path)).search(np.eye(8)[4], k=1)
+    assert results[0].item.item_location == "/b/README.md"
+
+
+def test_update_and_remove(tmp_path):
+    store = IndexStore(str(tmp_path))
+    store.add_or_update(make_item("/a/README.md"), make_db(["old "], [0]))
+    store.add_or_update(make_item("/b/README.md"), make_db(["b "], [1]))
+    store.add_or_update(make_item("/a/README.md"), make_db(["new "], [0]))
+    assert len(store.metadata) == 2
+    assert [r.fragment.fragment for r in store.search(np.eye(8)[0], k=3)] == ["new "]
+
+    store.remove(0)
+    store = IndexStore(str(tmp_path))
+    assert [item.item_location for item in store.metadata] == ["/b/README.md"]
+    assert store.search(np.eye(8)[0], k=3) == []
+    assert len(store.search(np.eye(8)[1], k=3)) == 1
+
+
+def test_migrates_item_files(tmp_path):
+    item = make_item("/a/README.md")
+    item.index_location = "legacy.npz"
+    (tmp_path / "meta.json").write_text(json.dumps({"metadata": [item.to_dict()]}))
+    os.makedirs(tmp_path / "embeddings")
+    make_db(["a "], [2]).save(str(tmp_path / "embeddings" / "legacy.npz"))
+
+    store = IndexStore(str(tmp_path))
+    assert store.find("file", "/a/README.md").index_location == "legacy.npz"
+    assert not os.path.exists(tmp_path / "meta.json")
+    results = store.search(np.eye(8)[2], k=1)
+    assert [r.fragment.fragment for r in results] == ["a "]
+    assert not os.path.exists(tmp_path / "embeddings" / "legacy.npz")
+
+
+def test_loaded_fragments_cache(tmp_path):
+    store = IndexStore(str(tmp_path))
+    store.add_or_update(make_item("/a/README.md"), make_db(["a "], [0]))
+
+    # other stores in the same process reuse the loaded db
+    db = IndexStore(str(tmp_path)).fragments()
+    assert IndexStore(str(tmp_path)).fragments() is db
+
+    # until the files change, e.g. by another process
+    other = VectorDB()
+    other.load(str(tmp_path / "embeddings" / "fragments.db"))
+    other.add(np.eye(8)[1], {"text": "b ", "item": store.metadata[0].index_location})
+    other.commit(str(tmp_path / "embeddings" / "fragments.db"))
+    assert IndexStore(str(tmp_path)).fragments() is not db
+    assert len(IndexStore(str(tmp_path)).search(np.eye(8)[1], k=1)) == 1
+    # caching and searching a db with journal rows keeps its matrix mapped
+    assert isinstance(IndexStore(str(tmp_path)).fragments()._base, np.memmap)
+
+    cache = LoadedFragmentsCache(max_bytes=1)
+    cache.put(str(tmp_path / "embeddings" / "fragments.db"), LoadedFragments(db))
+    assert cache.get(str(tmp_path / "embeddings" / "fragments.db")) is None
+
+
+def test_refresh_file(tmp_path, monkeypatch):
+    from promptops.index import content
+
+    requested = []
+
+    def fake_embedding_batch(texts):
+        requested.extend(texts)
+        return [(text, np.ones(8, dtype=np.float32) / np.sqrt(8)) for text in texts]
+
+    monkeypatch.setattr(content, "embedding_batch", fake_embedding_batch)
+    doc = tmp_path / "README.md"
+    doc.write_text("# Title\n\nIntro.\n\n## Usage\n\nRun it.\n")
+    store = IndexStore(str(tmp_path / "index"))
+    item = make_item(str(doc))
+    db, embedded = content.index_chunks(doc.read_text())
+    assert embedded == 2
+    store.add_or_update(item, db)
+
+    # nothing changed since the item was indexed
+    item.last_indexed_on = datetime.fromtimestamp(os.path.getmtime(doc)).replace(year=2000)
+    item.content_hash = content.content_hash(doc.read_text())
+    requested.clear()
+    assert content.refresh_file(store, item) is None
+    assert requested == []
+
+    doc.write_text("# Title\n\nIntro.\n\n## Usage\n\nRun it twice.\n")
+    assert content.refresh_file(store, store.metadata[0]) == 1
+    assert requested == ["## Usage\n\nRun it twice.\n"]
+    store = IndexStore(str(tmp_path / "index"))
+    assert store.metadata[0].content_hash == content.content_hash(doc.read_text())
+    assert [obj["text"] for obj in store.item_db(store.metadata[0]).objects] == [
+        "# Title\n\nIntro.\n\n", "## Usage\n\nRun it twice.\n"
+    ]
+
+
+def test_index_files(tmp_path, monkeypatch):
+    from promptops.index import content
+
+    requested = []
+
+    def fake_embedding_batch(texts):
+        requested.extend(texts)
+        return [(text, np.eye(8, dtype=np.float32)[len(text) % 8]) for text in texts]
+
+    monkeypatch.setattr(content, "embedding_batch", fake_embedding_batch)
+    license_text = "## License\n\nMIT\n"
+    for name in ["a.md", "b.md", "c.md", "d.md", "e.md"]:
+        (tmp_path / name).write_text(f"# {name}\n\n{license_text}")
+    (tmp_path / "notes.txt").write_text("not markdown")
+    files = content.discover_files(str(tmp_path), lambda _, fname: fname.endswith(".md"))
+    assert len(files) == 5
+
+    store = IndexStore(str(tmp_path / "index"))
+    items = content.index_files(files + [str(tmp_path / "missing.md")], store, max_workers=2)
+    assert sorted(os.path.basename(item.item_location) for item, _ in items) == ["a.md", "b.md", "c.md", "d.md", "e.md"]
+    # the chunk shared by all the files is embedded once
+    assert sorted(requested) == sorted([f"# {name}\n\n" for name in ["a.md", "b.md", "c.md", "d.md", "e.md"]] + [license_text])
+    store.add_or_update_many(items)
+    store = IndexStore(str(tmp_path / "index"))
+    assert len(store.metadata) == 5
+    assert len(set(item.index_location for item in store.metadata)) == 5
+    assert len(store.fragments()) == 10
+
+    # a new file only embeds its unseen chunks, the others come from the index
+    requested.clear()
+    (tmp_path / "f.md").write_text(f"# f.md\n\n{license_text}")
+    item, db = content.index_file(str(tmp_path / "f.md"), store)
+    assert requested == ["# f.md\n\n"]
+    assert [obj["text"] for obj in db.objects] == ["# f.md\n\n", license_text]
+
+
+def test_fragment_texts(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_store, "TEXT_COMPACT_MIN_BYTES", 100)
+    store = IndexStore(str(tmp_path))
+    store.add_or_update(make_item("/a/README.md"), make_db(["a" * 40, "b" * 40], [0, 1]))
+    # the texts live outside of the objects and are read for the hits only
+    assert all("text" not in obj for obj in store.fragments().objects)
+    assert store.fragment_texts([1]) == ["b" * 40]
+
+    for i in range(5):
+        store.add_or_update(make_item("/a/README.md"), make_db([str(i) * 40, "b" * 40], [0, 1]))
+    # the replaced texts were compacted away
+    assert os.path.getsize(next((tmp_path / "embeddings").glob("*.text"))) <= 200
+    store = IndexStore(str(tmp_path))
+    assert [r.fragment.fragment for r in store.search(np.eye(8)[0], k=1)] == ["4" * 40 + "b" * 40]
+
+
+def test_catalog(tmp_path):
+    first, second = IndexStore(str(tmp_path)), IndexStore(str(tmp_path))
+    first.add_or_update_many([
+        (make_item("/a/README.md"), make_db(["a "], [0])),
+        (make_item("/b/README.md"), make_db(["b "], [1])),
+    ])
+    # another store, e.g. in another process, sees the items without reloading anything
+    item = second.find("file", "/b/README.md")
+    assert item is not None and second.find("url", "/b/README.md") is None
+
+    second.add_or_update(make_item("/b/README.md"), make_db(["b2 "], [1]))
+    assert first.find("file", "/b/README.md").index_location == item.index_location
+    first.remove_item(first.find("file", "/a/README.md"))
+    assert [item.item_location for item in IndexStore(str(tmp_path)).metadata] == ["/b/README.md"]
+
+
+def test_hybrid_search(tmp_path):
+    store = IndexStore(str(tmp_path))
+    store.add_or_update(make_item("/a/README.md"), make_db(["Use `git push --force-with-lease` to overwrite.\n\n"], [0]))
+    store.add_or_update(make_item("/b/README.md"), make_db(["Pushing rewrites the remote branch.\n\n"], [1]))
+
+    # lexical only, no embedding needed
+    results = store.search(None, k=3, query="what does --force-with-lease do")
+    assert [r.item.item_location for r in results] == ["/a/README.md"]
+
+    # the embedding prefers b, the exact flag brings a in too
+    results = store.search(np.eye(8)[1], k=3, min_similarity=0.5, query="--force-with-lease")
+    assert {r.item.item_location for r in results} == {"/a/README.md", "/b/README.md"}
+    results = store.search(np.eye(8)[1], k=3, min_similarity=0.5, query="--force-with-lease",
+                           accept_source=lambda meta: meta.item_location.startswith("/b"))
+    assert [r.item.item_location for r in results] == ["/b/README.md"]
+
+    # a single common word of the question doesn't bring in an unrelated text
+    store.add_or_update(make_item("/c/CHANGES.md"), make_db(["Release notes: we changed the build files.\n\n"], [2]))
+    results = store.search(np.eye(8)[3], k=3, min_similarity=0.5, query="how do I list files")
+    assert results == []
+    results = store.search(None, k=3, query="which build files changed")
+    assert [r.item.item_location for r in results] == ["/c/CHANGES.md"]
+
+    # removed items leave the lexical index
+    store.remove_item(store.find("file", "/a/README.md"))
+    assert store.search(None, k=3, query="--force-with-lease") == []
+
+
+def test_lexical_backfill(tmp_path):
+    store = IndexStore(str(tmp_path))
+    store.add_or_update(make_item("/a/README.md"), make_db(["a "], [0]))
+    # a fragment stored by an older version, without a lexical id
+    db = store.fragments()
+    db.add(np.eye(8)[1], {"text": "run make install-deps first", "item": store.metadata[0].index_location})
+    db.commit(str(tmp_path / "embeddings" / "fragments.db"))
+
+    results = IndexStore(str(tmp_path)).search(None, k=1, query="install-deps")
+    assert [r.fragment.fragment for r in results] == ["a run make install-deps first"]
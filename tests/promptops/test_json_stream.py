@@ -0,0 +1,33 @@
+import json
+
+from promptops.index.json_stream import JSONStreamDecoder
+
+
+RECORDS = [
+    {"total": 3, "done": 1, "fragments": [{"text": 'a } tricky { "string" \\ here', "embedding": [0.5, -1.25e-3]}]},
+    {"total": 3, "done": 2, "fragments": []},
+    {"total": 3, "done": 3, "fragments": [{"text": "\\\\}", "nested": {"a": [{}]}}]},
+]
+
+
+def decode(data: bytes, chunk_size: int) -> tuple[list, bytes]:
+    decoder = JSONStreamDecoder()
+    records = []
+    for i in range(0, len(data), chunk_size):
+        records.extend(decoder.feed(data[i:i + chunk_size]))
+    return records, decoder.remaining
+
+
+def test_any_chunking():
+    for separator in ["\n", "", " \r\n"]:
+        data = separator.join(json.dumps(record) for record in RECORDS).encode("utf-8")
+        for chunk_size in [1, 2, 3, 7, 64, len(data)]:
+            assert decode(data, chunk_size) == (RECORDS, b"")
+
+
+def test_incomplete_record():
+    data = (json.dumps(RECORDS[0]) + "\n" + json.dumps(RECORDS[1])[:-2]).encode("utf-8")
+    records, remaining = decode(data, 5)
+    assert records == RECORDS[:1]
+    assert remaining == json.dumps(RECORDS[1])[:-2].encode("utf-8")
+
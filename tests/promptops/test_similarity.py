@@ -0,0 +1,433 @@
+import base64
+import json
+import os
+import numpy as np
+import pytest
+from promptops.similarity import VectorDB, remove_db
+
+
+def random_vectors(samples: int, d: int = 8, seed: int = 42) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    x = rng.standard_normal((samples, d))
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def test_add_grows_capacity():
+    x = random_vectors(100)
+    db = VectorDB()
+    for i, v in enumerate(x):
+        db.add(v, {"cmd": f"cmd {i}"})
+    assert len(db) == 100
+    assert db.vectors.shape == (100, 8)
+    assert np.allclose(db.vectors, x)
+    assert db.search(x[42], k=1, min_similarity=0.0)[0][0] == {"cmd": "cmd 42"}
+
+
+def test_add_batch():
+    x = random_vectors(50)
+    db = VectorDB()
+    db.add_batch(x[:20], [i for i in range(20)])
+    db.add(x[20], 20)
+    db.add_batch(x[21:], [i for i in range(21, 50)])
+    assert db.objects == list(range(50))
+    assert np.allclose(db.vectors, x)
+
+
+def test_remove():
+    x = random_vectors(10)
+    db = VectorDB()
+    db.add_batch(x, list(range(10)))
+    db.remove(3)
+    db.remove(-1)
+    # removed rows keep their place until compaction, but never show up in searches
+    assert len(db) == 8
+    assert list(db) == [0, 1, 2, 4, 5, 6, 7, 8]
+    assert 3 not in db
+    assert db.search(x[3], k=10, min_similarity=-1.0)[0][0] != 3
+    assert len(db.search(x[3], k=10, min_similarity=-1.0)) == 8
+    assert db.search_many(x[[3, 9]], k=1, min_similarity=0.9) == [[], []]
+
+    db.compact()
+    assert db.objects == [0, 1, 2, 4, 5, 6, 7, 8]
+    assert np.allclose(db.vectors, np.delete(x, [3, 9], axis=0))
+
+
+def test_exclude():
+    x = random_vectors(10)
+    db = VectorDB(exclude=lambda obj: obj.get("ignore", False))
+    db.add_batch(x[:5], [{"cmd": f"cmd {i}", "ignore": i == 1} for i in range(5)])
+    assert [o["cmd"] for o, _ in db.search(x[1], k=5, min_similarity=-1.0)][0] != "cmd 1"
+    assert len(db.search(x[1], k=5, min_similarity=-1.0)) == 4
+
+    db.objects[2]["ignore"] = True
+    db.reindex(2)
+    db.add(x[5], {"cmd": "cmd 5", "ignore": True})
+    assert {o["cmd"] for o, _ in db.search(x[1], k=10, min_similarity=-1.0)} == {"cmd 0", "cmd 3", "cmd 4"}
+
+
+def test_search_top_k():
+    x = random_vectors(1000)
+    db = VectorDB()
+    db.add_batch(x, list(range(1000)))
+    query = x[7]
+    expected = np.argsort(np.dot(x, query))[::-1][:5]
+    results = db.argsearch(query, k=5, min_similarity=-1.0)
+    assert [i for i, _ in results] == list(expected)
+    assert [o for o, _ in db.search(query, k=5, min_similarity=-1.0)] == list(expected)
+    assert len(db.search(query, k=2000, min_similarity=-1.0)) == 1000
+
+    # restricted to the odd rows
+    rows = np.arange(1, 1000, 2)
+    expected = rows[np.argsort(np.dot(x[rows], query))[::-1][:5]]
+    assert [i for i, _ in db.argsearch(query, k=5, min_similarity=-1.0, rows=rows)] == list(expected)
+
+
+def test_search_many():
+    x = random_vectors(200)
+    db = VectorDB()
+    db.add_batch(x, list(range(200)))
+    queries = x[[3, 10, 150]]
+    results = db.search_many(queries, k=3, min_similarity=0.0)
+    for result, query in zip(results, queries):
+        expected = db.search(query, k=3, min_similarity=0.0)
+        assert [o for o, _ in result] == [o for o, _ in expected]
+        assert np.allclose([s for _, s in result], [s for _, s in expected])
+    assert VectorDB().search_many(queries, k=3) == [[], [], []]
+
+
+def test_save_load(tmp_path):
+    x = random_vectors(30)
+    db = VectorDB()
+    db.add_batch(x, [{"cmd": f"cmd {i}", "ignore": False} for i in range(30)])
+    path = str(tmp_path / "history.db")
+    db.save(path)
+    db.save(path)
+    # the previous generation of data files is cleaned up
+    assert len(os.listdir(tmp_path)) == 4
+
+    loaded = VectorDB()
+    loaded.load(path)
+    assert len(loaded) == 30
+    assert isinstance(loaded.vectors, np.memmap)
+    assert np.allclose(loaded.vectors, x)
+    assert loaded.objects == db.objects
+
+    # copy-on-write: updating a loaded db does not touch the file until it is saved
+    loaded.update_or_add(x[0], {"cmd": "cmd 29", "ignore": False})
+    loaded.add(x[1], {"cmd": "new", "ignore": False})
+    assert np.allclose(loaded.vectors[29], x[0])
+    reloaded = VectorDB()
+    reloaded.load(path)
+    assert np.allclose(reloaded.vectors[29], x[29])
+
+    remove_db(path)
+    assert os.listdir(tmp_path) == []
+
+
+def test_load_legacy(tmp_path):
+    x = random_vectors(5)
+    objects = [{"cmd": f"cmd {i}"} for i in range(5)]
+    path = str(tmp_path / "history.db")
+    with open(path, "wb") as f:
+        np.savez(f, vectors=x, objects=objects)
+
+    db = VectorDB()
+    db.load(path)
+    assert db.objects == objects
+    assert db.vectors.dtype == np.float32
+    assert np.allclose(db.vectors, x)
+
+    db.save(path)
+    migrated = VectorDB()
+    migrated.load(path)
+    assert migrated.objects == objects
+    assert migrated.vectors.dtype == np.float32
+
+
+def test_commit_journal(tmp_path):
+    x = random_vectors(20)
+    path = str(tmp_path / "history.db")
+    db = VectorDB()
+    db.add_batch(x[:10], [{"cmd": f"cmd {i}"} for i in range(10)])
+    # nothing on disk yet, so the first commit writes the db file
+    db.commit(path)
+    assert not os.path.exists(path + ".journal")
+
+    db.add(x[10], {"cmd": "cmd 10"})
+    db.objects[3]["ignore"] = True
+    db.commit(path, [3])
+    db.add_batch(x[11:], [{"cmd": f"cmd {i}"} for i in range(11, 20)])
+    db.commit(path)
+    assert os.path.exists(path + ".journal")
+
+    # the vectors are raw rows in a sidecar, the journal only has small json records
+    with open(path + ".journal", "rb") as f:
+        assert all("vector" not in json.loads(line) for line in f)
+    # ten added rows and an updated one, as float32
+    assert os.path.getsize(path + ".journal.vectors") == 11 * 4 * x.shape[1]
+
+    # a torn write at the end of the journal is ignored
+    with open(path + ".journal", "ab") as f:
+        f.write(b'{"op": "add", "row"')
+
+    loaded = VectorDB()
+    loaded.load(path)
+    assert loaded.objects == db.objects
+    assert np.allclose(loaded.vectors, x)
+
+
+def test_replays_base64_journal_records(tmp_path):
+    x = random_vectors(3)
+    path = str(tmp_path / "history.db")
+    db = VectorDB()
+    db.add_batch(x[:2], [0, 1])
+    db.save(path)
+    # journals written before the vectors moved to the sidecar
+    with open(path + ".journal", "w") as f:
+        for op, row, vector in (("add", 2, x[2]), ("update", 0, x[2])):
+            f.write(json.dumps({
+                "op": op, "row": row, "dtype": vector.dtype.str, "object": op,
+                "vector": base64.b64encode(vector.tobytes()).decode("ascii"),
+            }) + "\n")
+    loaded = VectorDB()
+    loaded.load(path)
+    assert loaded.objects == ["update", 1, "add"]
+    assert np.allclose(loaded.vectors, x[[2, 1, 2]])
+
+
+def test_commit_compacts_by_journal_bytes(tmp_path, monkeypatch):
+    from promptops import similarity
+    monkeypatch.setattr(similarity, "JOURNAL_COMPACT_MAX_BYTES", 3 * 8 * 4)
+    x = random_vectors(6)
+    path = str(tmp_path / "history.db")
+    db = VectorDB()
+    db.add(x[0], 0)
+    db.commit(path)
+    for i in range(1, 6):
+        db.add(x[i], i)
+        db.commit(path)
+    # compacted once the fourth row went to the journal, so only the fifth one is left
+    assert os.path.getsize(path + ".journal.vectors") == 8 * 4
+    loaded = VectorDB()
+    loaded.load(path)
+    assert loaded.objects == list(range(6))
+
+
+def test_commit_compacts(tmp_path):
+    x = random_vectors(300)
+    path = str(tmp_path / "history.db")
+    db = VectorDB()
+    db.add(x[0], 0)
+    db.commit(path)
+    for i in range(1, 300):
+        db.add(x[i], i)
+        db.commit(path)
+    with open(path + ".journal", "rb") as f:
+        assert len(f.readlines()) < 299
+    loaded = VectorDB()
+    loaded.load(path)
+    assert loaded.objects == list(range(300))
+    assert np.allclose(loaded.vectors, x)
+
+
+def test_key_index(tmp_path):
+    x = random_vectors(10)
+    db = VectorDB(key=lambda obj: obj["cmd"])
+    db.add_batch(x[:5], [{"cmd": f"cmd {i}"} for i in range(5)])
+    assert db.find("cmd 3") == 3
+    assert db.find("missing") is None
+    assert {"cmd": "cmd 4", "ignore": True} in db
+
+    assert db.update_or_add(x[9], {"cmd": "cmd 2"}) == 2
+    assert np.allclose(db.vectors[2], x[9])
+    assert db.update_or_add(x[5], {"cmd": "cmd 5"}) == 5
+    assert db.find("cmd 5") == 5
+
+    db.remove(0)
+    assert db.find("cmd 0") is None
+    assert db.find("cmd 5") == 5
+
+    path = str(tmp_path / "history.db")
+    db.save(path)
+    assert db.find("cmd 5") == 4
+    loaded = VectorDB(key=lambda obj: obj["cmd"])
+    loaded.load(path)
+    assert loaded.find("cmd 5") == 4
+
+
+def test_commit_deletes(tmp_path):
+    x = random_vectors(20)
+    path = str(tmp_path / "history.db")
+    db = VectorDB()
+    db.add_batch(x, list(range(20)))
+    db.save(path)
+    db.remove(4)
+    db.commit(path)
+    loaded = VectorDB()
+    loaded.load(path)
+    assert list(loaded) == [i for i in range(20) if i != 4]
+
+    # crossing the dead fraction compacts the db file
+    for i in range(5, 11):
+        db.remove(i)
+    db.commit(path)
+    assert not os.path.exists(path + ".journal")
+    loaded = VectorDB()
+    loaded.load(path)
+    assert loaded.objects == [0, 1, 2, 3] + list(range(11, 20))
+
+
+def test_commit_from_several_processes(tmp_path):
+    x = random_vectors(24)
+    path = str(tmp_path / "history.db")
+    db = VectorDB()
+    db.add_batch(x[:20], list(range(20)))
+    db.save(path)
+    a, b = VectorDB(), VectorDB()
+    a.load(path)
+    b.load(path)
+
+    a.add(x[20], "x")
+    a.commit(path)
+    b.add(x[21], "y")
+    b.commit(path)
+    # b saw the row of a before placing its own, like a fresh load does
+    assert b.objects[20:] == ["x", "y"]
+    b.objects[21] = "y2"
+    b.commit(path, [21])
+    b.remove(3)
+    b.commit(path)
+    a.remove(5)
+    a.commit(path)
+
+    loaded = VectorDB()
+    loaded.load(path)
+    assert list(loaded) == [i for i in range(20) if i not in (3, 5)] + ["x", "y2"]
+    assert np.allclose(loaded.vectors[21], x[21])
+
+
+def test_commit_after_another_process_compacted(tmp_path):
+    x = random_vectors(24)
+    path = str(tmp_path / "history.db")
+    db = VectorDB()
+    db.add_batch(x[:20], list(range(20)))
+    db.save(path)
+    a, b = VectorDB(), VectorDB()
+    a.load(path)
+    b.load(path)
+    b.add(x[20], "y")
+    b.remove(0)
+    b.commit(path)
+    b.save(path)
+
+    # the rows of a shifted on disk, its update still lands on the same row
+    a.objects[10] = "ten"
+    a.add(x[21], "z")
+    a.commit(path, [10])
+    loaded = VectorDB()
+    loaded.load(path)
+    assert list(loaded) == list(range(1, 10)) + ["ten"] + list(range(11, 20)) + ["y", "z"]
+
+
+def test_load_keeps_journal_rows_apart(tmp_path):
+    x = random_vectors(22)
+    path = str(tmp_path / "history.db")
+    db = VectorDB()
+    db.add_batch(x[:20], list(range(20)))
+    db.save(path)
+    db.add(x[20], "x")
+    db.commit(path)
+    db.update_or_add(x[21], 3, equals=lambda a, b: a == b)
+    db.commit(path, [3])
+
+    loaded = VectorDB()
+    loaded.load(path)
+    # the mapped matrix is neither copied nor grown for the journal rows, and the objects stay encoded
+    assert isinstance(loaded._base, np.memmap) and len(loaded._base) == 20
+    assert loaded._objects_raw is not None
+    assert loaded.argsearch(x[20], k=1) == [(20, pytest.approx(1.0))]
+    assert loaded.argsearch(x[21], k=1) == [(3, pytest.approx(1.0))]
+    assert [objs[0][0] for objs in loaded.search_many(x[20:22])] == ["x", 3]
+
+    expected = x[:21].copy()
+    expected[3] = x[21]
+    assert np.allclose(loaded.vectors, expected)
+    assert loaded.objects == list(range(20)) + ["x"]
+
+
+def test_commit_skips_rows_removed_before_commit(tmp_path):
+    x = random_vectors(21)
+    path = str(tmp_path / "history.db")
+    db = VectorDB()
+    db.add_batch(x[:20], list(range(20)))
+    db.save(path)
+    db.add(x[20], "b")
+    db.remove(20)
+    db.commit(path)
+    loaded = VectorDB()
+    loaded.load(path)
+    assert "b" not in loaded
+    assert len(loaded) == 20
+    assert loaded.vectors.shape[0] == 20
+
+
+def test_approximate_search(tmp_path, monkeypatch):
+    from promptops import similarity
+
+    monkeypatch.setattr(similarity, "ANN_MIN_ROWS", 1000)
+    rng = np.random.default_rng(42)
+    centers = rng.standard_normal((50, 32))
+    x = centers[rng.integers(0, 50, 3000)] + 0.5 * rng.standard_normal((3000, 32))
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    db = VectorDB(exclude=lambda obj: obj % 100 == 0)
+    db.add_batch(x[:2000], list(range(2000)))
+    exact = [[i for i, _ in db.argsearch(q, k=5, min_similarity=-1.0)] for q in x[2000:2100]]
+
+    path = str(tmp_path / "history.db")
+    db.save(path)
+    assert os.path.exists(path + ".ivf")
+    loaded = VectorDB(exclude=lambda obj: obj % 100 == 0)
+    loaded.load(path)
+    assert loaded._ann is not None
+    approximate = [[i for i, _ in loaded.argsearch(q, k=5, min_similarity=-1.0)] for q in x[2000:2100]]
+    recall = np.mean([len(set(a) & set(e)) / 5 for a, e in zip(approximate, exact)])
+    assert recall > 0.9
+    assert all(i % 100 != 0 for result in approximate for i in result)
+
+    # rows added after training are assigned to the existing partitions
+    loaded.add_batch(x[2000:], list(range(2000, 3000)))
+    assert loaded.argsearch(x[2501], k=1)[0][0] == 2501
+    assert len(loaded._ann.assignments) == 3000
+
+    loaded.remove(2500)
+    loaded.save(path)
+    assert len(loaded._ann.assignments) == 2999
+    remove_db(path)
+    assert os.listdir(tmp_path) == []
+
+
+def test_quantized(tmp_path):
+    x = random_vectors(2000, d=64)
+    db = VectorDB(quantized=True, exclude=lambda obj: obj == 7)
+    db.add_batch(x, list(range(2000)))
+    assert db.vectors.dtype == np.float32
+    exact = VectorDB(exclude=lambda obj: obj == 7)
+    exact.add_batch(x, list(range(2000)))
+    for q in x[:50]:
+        expected = exact.argsearch(q, k=3, min_similarity=-1.0)
+        results = db.argsearch(q, k=3, min_similarity=-1.0)
+        assert [i for i, _ in results] == [i for i, _ in expected]
+        # the shortlist is re-scored with the full vectors
+        assert np.allclose([s for _, s in results], [s for _, s in expected])
+    assert db.argsearch(x[7], k=1, min_similarity=-1.0)[0][0] != 7
+
+    path = str(tmp_path / "history.db")
+    db.save(path)
+    loaded = VectorDB(quantized=True)
+    loaded.load(path)
+    assert loaded._codes.dtype == np.int8
+    loaded.update_or_add(x[0], 1999, equals=lambda a, b: a == b)
+    # rows 0 and 1999 have the same vector now, so their order is up to the sort
+    assert {i for i, _ in loaded.argsearch(x[0], k=2, min_similarity=-1.0)} == {0, 1999}
+    remove_db(path)
+    assert os.listdir(tmp_path) == []
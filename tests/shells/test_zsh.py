@@ -130,3 +130,14 @@ def test_add_to_history():
 
         cmds = shell.get_full_history()
         assert cmds == (expected + expected_extra)
+
+
+def test_unmetafy():
+    from promptops.shells.zsh import unmetafy
+
+    assert unmetafy(b"echo test") == (b"echo test", b"")
+    assert unmetafy(b"echo \xF0\x83\xBF\x83\xB8\x83\xA3") == ("echo 😃".encode("utf-8"), b"")
+    # the metafied byte is in the next block
+    assert unmetafy(b"echo \xF0\x83\xBF\x83") == (b"echo \xF0\x9F", b"\x83")
+    assert unmetafy(b"\x83\x83\x83") == (b"\xa3", b"\x83")
+    assert unmetafy(b"\x83\xa3\x83\x83") == (b"\x83\xa3", b"")
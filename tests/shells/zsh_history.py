@@ -0,0 +1,85 @@
+import os
+import random
+import tempfile
+from time import time
+
+from promptops.shells.base import readline, reverse_readline
+from promptops.shells.zsh import unmetafy, Zsh
+
+WORDS = ["git", "commit", "-m", "ls", "-la", "cd", "docker", "run", "--rm", "echo", "grep", "-r", "kubectl", "get"]
+NON_ASCII = ["héllo", "ăşţ", "日本語", "🤔", "über"]
+
+
+def metafy(data: bytes) -> bytes:
+    result = bytearray()
+    for b in data:
+        if b == 0 or 0x83 <= b <= 0xa2:
+            result += bytes([0x83, b ^ 32])
+        else:
+            result.append(b)
+    return bytes(result)
+
+
+def unmetafy_bytewise(cmd: bytes) -> (bytes, bytes):
+    """The previous implementation, one byte at a time"""
+    i = 0
+    result = b""
+    while i < len(cmd):
+        if cmd[i] == 0x83:
+            if i + 1 >= len(cmd):
+                return result, cmd[i:]
+            result += bytes([cmd[i+1] ^ 32])
+            i += 1
+        else:
+            result += cmd[i: i+1]
+        i += 1
+    return result, b""
+
+
+def generate_history(path: str, lines: int, seed: int = 42):
+    random.seed(seed)
+    with open(path, "wb") as f:
+        for i in range(lines):
+            words = random.choices(WORDS, k=random.randint(1, 6))
+            if i % 10 == 0:
+                words.append(random.choice(NON_ASCII))
+            f.write(f": {1683929171 + i}:0;{' '.join(words)}\n".encode("utf-8"))
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(metafy(data))
+
+
+def benchmark(name: str, path: str, transform):
+    now = time()
+    lines = sum(1 for _ in readline(path, transform=transform))
+    print(f"{name}: read {lines} lines in {time() - now:.3f} seconds")
+    now = time()
+    lines = sum(1 for _ in reverse_readline(path, transform=transform))
+    print(f"{name}: read {lines} lines in reverse in {time() - now:.3f} seconds")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # the bytewise decoder is too slow for the full history, it is compared on a sample
+        sample_path = os.path.join(tmp_dir, ".zsh_history_sample")
+        generate_history(sample_path, 50_000)
+        print(f"sample history of {os.path.getsize(sample_path) / 1024 / 1024:.1f} MB")
+        benchmark("bytewise", sample_path, unmetafy_bytewise)
+        benchmark("vectorized", sample_path, unmetafy)
+        same = all(
+            a == b for a, b in zip(readline(sample_path, transform=unmetafy_bytewise), readline(sample_path, transform=unmetafy))
+        )
+        print(f"same lines: {same}")
+
+        path = os.path.join(tmp_dir, ".zsh_history")
+        generate_history(path, 1_000_000)
+        print(f"history of {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+        benchmark("vectorized", path, unmetafy)
+        now = time()
+        commands = sum(1 for _ in Zsh(path)._get_cmds_from_lines(readline(path, transform=unmetafy)))
+        print(f"parsed {commands} commands in {time() - now:.3f} seconds")
+
+
+if __name__ == "__main__":
+    main()